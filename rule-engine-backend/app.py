@@ -1,7 +1,12 @@
 from flask import Flask
 from flask_cors import CORS
-from extensions import db
+from extensions import db, rule_cache
+from parser import parse_cache
+from migrations import upgrade_database
+from tracing import tracer
+from bulk import import_rules_command
 from routes import rule_bp, evaluation_bp
+from routes.evaluation_routes import ensure_rule_network
 import os
 from dotenv import load_dotenv
 
@@ -13,15 +18,25 @@ def create_app():
     CORS(app)
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DB_URI')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config['RULE_CACHE_SIZE'] = int(os.getenv('RULE_CACHE_SIZE', 1024))
+    app.config['PARSE_CACHE_SIZE'] = int(os.getenv('PARSE_CACHE_SIZE', 1024))
+    app.config['TRACE_LEVEL'] = os.getenv('TRACE_LEVEL', 'off')
+    app.config['PARSE_WORKERS'] = int(os.getenv('PARSE_WORKERS', os.cpu_count() or 1))
     db.init_app(app)
+    rule_cache.init_app(app)
+    parse_cache.init_app(app)
+    tracer.init_app(app)
 
     # Register Blueprints
     app.register_blueprint(rule_bp)
     app.register_blueprint(evaluation_bp)
+    app.cli.add_command(import_rules_command)
 
-    # Create database tables
+    # Create database tables, upgrade existing ones and build the rule matching indexes
     with app.app_context():
         db.create_all()
+        upgrade_database()
+        ensure_rule_network()
 
     return app
 
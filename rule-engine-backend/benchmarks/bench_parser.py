@@ -0,0 +1,38 @@
+"""
+Parsing rules of 10, 1k and 100k conditions with parse_rule against the pyparsing grammar.
+
+pyparsing is only timed up to 1k conditions, past which it takes minutes per rule.
+
+Run from rule-engine-backend: python -m benchmarks.bench_parser [conditions ...]
+"""
+import sys
+import time
+
+from parser import parse_rule
+
+PYPARSING_MAX_CONDITIONS = 1000
+
+def rule_string(conditions: int) -> str:
+    return ' AND '.join(f"(age > {i} OR department = 'd{i}')" for i in range(conditions // 2))
+
+def best_of(repeat: int, parse) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main(*sizes: int):
+    for conditions in sizes or (10, 1000, 100000):
+        text = rule_string(conditions)
+        repeat = 5 if conditions <= PYPARSING_MAX_CONDITIONS else 1
+        ours = best_of(repeat, lambda: parse_rule(text, cache=False))
+        line = f"{conditions:>7} conditions: parse_rule {ours * 1000:9.2f} ms"
+        if conditions <= PYPARSING_MAX_CONDITIONS:
+            theirs = best_of(repeat, lambda: parse_rule(text, parser='pyparsing'))
+            line += f", pyparsing {theirs * 1000:9.2f} ms ({theirs / ours:.0f}x)"
+        print(line)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
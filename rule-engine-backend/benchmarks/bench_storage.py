@@ -0,0 +1,64 @@
+"""
+Size and load time of rules stored as ast_json against the FlatRule binary in ast_binary.
+
+Loads go through the same calls as Rule.load_flat and Rule.load_ast: FlatRule.from_dict
+on the parsed JSON, or FlatRule.from_bytes, followed by to_ast for the full AST.
+
+Run from rule-engine-backend: python -m benchmarks.bench_storage [rules] [combined rules]
+"""
+import json
+import random
+import sys
+import time
+
+from flat import FlatRule
+from parser import parse_rule
+from utils import ast_to_dict, combine_asts
+
+ATTRIBUTES = ('age', 'salary', 'department', 'experience', 'score', 'region', 'level')
+
+def random_rule_string(rng: random.Random) -> str:
+    conditions = []
+    for attribute in rng.sample(ATTRIBUTES, 7):
+        if rng.random() < 0.5:
+            conditions.append(f"{attribute} > {rng.randint(0, 100000)}")
+        else:
+            conditions.append(f"{attribute} = '{rng.choice(('Sales', 'Marketing', 'Engineering', 'EU', 'US'))}'")
+    return (f"(({conditions[0]} AND {conditions[1]}) OR ({conditions[2]} AND {conditions[3]})) "
+            f"AND ({conditions[4]} OR {conditions[5]} OR {conditions[6]})")
+
+def timed(function, values: list):
+    start = time.perf_counter()
+    results = [function(value) for value in values]
+    return results, time.perf_counter() - start
+
+def main(rules: int = 2000, combined_rules: int = 200):
+    rng = random.Random(0)
+    asts = [parse_rule(random_rule_string(rng), cache=False) for _ in range(rules)]
+    stored_json = [json.dumps(ast_to_dict(ast)) for ast in asts]
+    stored_binary = [FlatRule.from_ast(ast).to_bytes() for ast in asts]
+    combined = combine_asts(asts[:combined_rules])
+
+    print(f"{rules} rules of 7 conditions")
+    print(f"{'size per rule:':24}ast_json {sum(map(len, stored_json)) / rules:8.0f} B, "
+          f"ast_binary {sum(map(len, stored_binary)) / rules:8.0f} B")
+    print(f"{f'{combined_rules}-rule combination:':24}ast_json {len(json.dumps(ast_to_dict(combined))) / 1024:8.1f} KB, "
+          f"ast_binary {len(FlatRule.from_ast(combined).to_bytes()) / 1024:8.1f} KB")
+
+    # Best of three for each load path
+    loads = {
+        'rule cache (FlatRule)': (lambda data: FlatRule.from_dict(json.loads(data)), FlatRule.from_bytes),
+        'full AST (Node)': (lambda data: FlatRule.from_dict(json.loads(data)).to_ast(),
+                            lambda data: FlatRule.from_bytes(data).to_ast()),
+    }
+    for name, (load_json, load_binary) in loads.items():
+        json_results, json_seconds = min((timed(load_json, stored_json) for _ in range(3)), key=lambda run: run[1])
+        binary_results, binary_seconds = min((timed(load_binary, stored_binary) for _ in range(3)),
+                                             key=lambda run: run[1])
+        if name == 'full AST (Node)':
+            assert json_results == binary_results == asts
+        print(f"{name + ':':24}ast_json {json_seconds * 1000:8.1f} ms, ast_binary {binary_seconds * 1000:8.1f} ms "
+              f"({json_seconds / binary_seconds:.1f}x)")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
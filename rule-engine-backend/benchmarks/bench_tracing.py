@@ -0,0 +1,72 @@
+"""
+Parsing and combining rules with tracing off, on at DEBUG with a no-op hook, and on at INFO
+with the default logging hook writing to an in-memory stream. Logging at DEBUG is left out:
+every simplification event formats the node it simplifies, which for combine_asts is the
+whole combined rule.
+
+Run from rule-engine-backend: python -m benchmarks.bench_tracing [rules]
+"""
+import importlib.util
+import io
+import logging
+import random
+import sys
+import time
+
+from parser import parse_rule
+from tracing import DEBUG, INFO, log_trace_hook, tracer
+from utils import combine_asts
+
+def random_rule_string(rng: random.Random) -> str:
+    # Repeated conditions give simplify_ast idempotent and absorption events to report
+    conditions = [f"{rng.choice(('age', 'salary', 'score'))} > {rng.randint(0, 5)}" for _ in range(3)]
+    return f"({conditions[0]} AND ({conditions[0]} OR {conditions[1]})) OR {conditions[2]} OR {conditions[2]}"
+
+def time_workloads(rule_strings: list, pyparsing_strings: list) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    asts = [parse_rule(rule_string, cache=False) for rule_string in rule_strings]
+    timings['parse_rule'] = time.perf_counter() - start
+    start = time.perf_counter()
+    combine_asts(asts)
+    timings['combine_asts'] = time.perf_counter() - start
+    if pyparsing_strings:
+        start = time.perf_counter()
+        for rule_string in pyparsing_strings:
+            parse_rule(rule_string, parser='pyparsing')
+        timings['pyparsing'] = time.perf_counter() - start
+    return timings
+
+def main(rules: int = 2000):
+    rng = random.Random(0)
+    rule_strings = [random_rule_string(rng) for _ in range(rules)]
+    # The pyparsing grammar is far slower, so it parses a twentieth of the rules
+    pyparsing_strings = rule_strings[:rules // 20] if importlib.util.find_spec('pyparsing') else []
+
+    events = []
+    stream = io.StringIO()
+    logger = logging.getLogger('rule_engine.trace')
+    logger.addHandler(logging.StreamHandler(stream))
+    logger.setLevel(INFO)
+    logger.propagate = False
+    modes = {
+        'off': (None, None),
+        'no-op hook': (lambda event, level, fields: events.append(event), DEBUG),
+        'logging hook': (log_trace_hook, INFO),
+    }
+    print(f"{rules} rules ({len(pyparsing_strings)} with pyparsing)")
+    for mode, (hook, level) in modes.items():
+        if hook is None:
+            tracer.disable()
+        else:
+            tracer.enable(hook, level)
+        # Best of three, after a warm-up run
+        time_workloads(rule_strings, pyparsing_strings)
+        runs = [time_workloads(rule_strings, pyparsing_strings) for _ in range(3)]
+        tracer.disable()
+        best = {workload: min(run[workload] for run in runs) for workload in runs[0]}
+        print(f"{mode:>13}: " + ', '.join(f"{workload} {seconds * 1000:8.2f} ms" for workload, seconds in best.items()))
+    print(f"{len(events) // 4} events per run with the no-op hook")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
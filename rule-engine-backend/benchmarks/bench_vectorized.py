@@ -0,0 +1,43 @@
+"""
+Columnar evaluation with evaluate_ast_columns against a loop of evaluate_ast over the same rows.
+
+Run from rule-engine-backend: python -m benchmarks.bench_vectorized [rows]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+from evaluator import evaluate_ast
+from parser import parse_rule
+from vectorized import evaluate_ast_columns
+
+RULE = "(age > 30 AND department = 'Sales') OR (salary > 50000 AND experience >= 5)"
+
+def main(rows: int = 100000):
+    rng = random.Random(0)
+    columns = {
+        'age': np.array([rng.randint(18, 65) for _ in range(rows)], dtype=np.int64),
+        'department': np.array([rng.choice(('Sales', 'Marketing', 'Engineering')) for _ in range(rows)]),
+        'salary': np.array([rng.uniform(20000, 120000) for _ in range(rows)]),
+        'experience': np.array([rng.randint(0, 20) for _ in range(rows)], dtype=np.int64),
+    }
+    ast = parse_rule(RULE)
+    records = [dict(zip(columns, values)) for values in zip(*(column.tolist() for column in columns.values()))]
+
+    start = time.perf_counter()
+    expected = [evaluate_ast(ast, record) for record in records]
+    row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mask = evaluate_ast_columns(ast, columns)
+    column_seconds = time.perf_counter() - start
+
+    assert mask.tolist() == expected
+    print(f"{rows} rows, rule: {RULE}")
+    print(f"evaluate_ast loop:    {row_seconds * 1000:9.1f} ms")
+    print(f"evaluate_ast_columns: {column_seconds * 1000:9.1f} ms ({row_seconds / column_seconds:.0f}x)")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""
+Throughput of parse_rules_parallel from 1 worker up to one per CPU, sending back FlatRule bytes
+(serialize_ast, as for bulk import) or nothing (discard_ast, as for /validate_rules).
+
+Pools are started and warmed up before they are timed, as they are shared by later calls.
+
+Run from rule-engine-backend: python -m benchmarks.bench_workers [rules] [max workers]
+"""
+import os
+import random
+import sys
+import time
+
+from parser import discard_ast, parse_rules_parallel, serialize_ast
+
+def random_rule_string(rng: random.Random) -> str:
+    conditions = [f"{rng.choice(('age', 'salary', 'score', 'experience'))} > {rng.randint(0, 1000)}"
+                  for _ in range(4)]
+    department = rng.choice(('Sales', 'Marketing', 'Engineering'))
+    rule_string = (f"({conditions[0]} AND {conditions[1]}) OR "
+                   f"({conditions[2]} AND {conditions[3]} AND department = '{department}')")
+    # A few invalid rules, reported as errors rather than failing the batch
+    return rule_string + ' (' if rng.random() < 0.01 else rule_string
+
+def main(rules: int = 50000, max_workers: int = os.cpu_count() or 1):
+    rng = random.Random(0)
+    rule_strings = [random_rule_string(rng) for _ in range(rules)]
+    print(f"{rules} rules, {os.cpu_count()} CPUs")
+    for prepare in (serialize_ast, discard_ast):
+        expected = None
+        baseline = None
+        for workers in range(1, max_workers + 1):
+            # Warm up: start the pool and import the parser in its workers
+            list(parse_rules_parallel(rule_strings[:4000], workers=workers, prepare=prepare))
+            start = time.perf_counter()
+            results = list(parse_rules_parallel(rule_strings, workers=workers, prepare=prepare))
+            seconds = time.perf_counter() - start
+            if expected is None:
+                expected = results
+                baseline = seconds
+            assert results == expected
+            print(f"{prepare.__name__:>13} workers={workers:<3} {seconds:7.2f} s "
+                  f"({rules / seconds / 1000:5.1f}k rules/s, {baseline / seconds:4.2f}x workers=1)")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
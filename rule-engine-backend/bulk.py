@@ -0,0 +1,197 @@
+import csv
+import json
+from collections import deque
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, rule_network
+from flat import FlatRule
+from models import Rule, RuleAttribute
+from parser import parse_rules_parallel
+
+BULK_FORMATS = ('ndjson', 'csv')
+DEFAULT_CHUNK_SIZE = 1000
+
+def read_rule_strings(stream: Iterable[bytes], format: str) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Read (line number, rule string, error) entries from NDJSON or CSV lines of UTF-8 bytes.
+
+    NDJSON lines hold a JSON string or an object with a 'rule_string' key. CSV rows take the
+    'rule_string' column when the first row is a header naming it, and the first column otherwise.
+    Blank lines are skipped, and a line that is not valid UTF-8 is reported as an error.
+    """
+    # Undecodable bytes become lone surrogates, so one bad line does not end the import
+    lines = (line.decode('utf-8', 'surrogateescape') for line in stream)
+    if format == 'ndjson':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            if not _is_utf8(line):
+                yield line_number, None, "Invalid UTF-8"
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(value, dict):
+                value = value.get('rule_string')
+            if not isinstance(value, str):
+                yield line_number, None, "Expected a rule string or an object with a 'rule_string' string"
+                continue
+            yield line_number, value, None
+    elif format == 'csv':
+        reader = csv.reader(lines)
+        column = 0
+        for row in reader:
+            if not all(_is_utf8(cell) for cell in row):
+                yield reader.line_num, None, "Invalid UTF-8"
+                continue
+            if reader.line_num == 1 and 'rule_string' in row:
+                column = row.index('rule_string')
+                continue
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if column >= len(row):
+                yield reader.line_num, None, "Missing rule_string column"
+                continue
+            yield reader.line_num, row[column], None
+    else:
+        raise ValueError(f"Unknown format '{format}', expected one of {', '.join(BULK_FORMATS)}")
+
+def _is_utf8(text: str) -> bool:
+    try:
+        text.encode('utf-8')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+def import_rules(entries: Iterable[Tuple[int, Optional[str], Optional[str]]], workers: int = 1,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """
+    Store rules read by read_rule_strings. Rules are parsed and their column values computed by
+    parse_rules_parallel while earlier rules are written, chunk_size rules at a time with one
+    multi-row insert per table in one transaction. Rules equivalent to a stored rule are counted
+    as existing rather than stored again. Returns the counts, the errors of the lines that could
+    not be imported and the last line processed. If the import stops early, for example because
+    the database fails, the chunks committed so far are kept and the summary says so in 'error'.
+    """
+    summary = {'created': 0, 'existing': 0, 'errors': [], 'last_line': 0}
+    # Entries whose rule string has been handed to the parser, or that failed before parsing
+    read = deque()
+    last_read = 0
+
+    def rule_strings():
+        nonlocal last_read
+        for entry in entries:
+            read.append(entry)
+            last_read = entry[0]
+            if entry[2] is None:
+                yield entry[1]
+
+    def report_read_errors():
+        while read and read[0][2] is not None:
+            line_number, _, error = read.popleft()
+            summary['errors'].append({'line': line_number, 'error': error})
+
+    rows = []
+    try:
+        for values, error in parse_rules_parallel(rule_strings(), workers, prepare=Rule.column_values):
+            report_read_errors()
+            line_number, _, _ = read.popleft()
+            if error is not None:
+                summary['errors'].append({'line': line_number, 'error': error})
+                continue
+            rows.append(values)
+            if len(rows) >= chunk_size:
+                _store_chunk(rows, summary)
+                summary['last_line'] = line_number
+                rows = []
+        report_read_errors()
+        if rows:
+            _store_chunk(rows, summary)
+        summary['last_line'] = last_read
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error importing rules: {e}")
+        summary['error'] = str(e)
+    summary['errors'].sort(key=lambda error: error['line'])
+    return summary
+
+def _store_chunk(rows: List[dict], summary: dict):
+    # Skip rules equivalent to a stored rule or to an earlier rule of the chunk
+    hashes = [values['canonical_hash'] for values in rows]
+    stored = {value for (value,) in db.session.query(Rule.canonical_hash).filter(Rule.canonical_hash.in_(hashes))}
+    # Counted once the chunk is committed, so a failed chunk leaves the summary as it was
+    existing = 0
+    new_rows = []
+    for values in rows:
+        if values['canonical_hash'] in stored:
+            existing += 1
+            continue
+        stored.add(values['canonical_hash'])
+        new_rows.append(values)
+    if not new_rows:
+        summary['existing'] += existing
+        return
+
+    try:
+        rule_ids = _insert_rows(new_rows)
+        db.session.commit()
+    except IntegrityError:
+        # An equivalent rule was stored concurrently; store the chunk one rule at a time instead
+        db.session.rollback()
+        inserted = []
+        rule_ids = []
+        for values in new_rows:
+            try:
+                rule_ids.extend(_insert_rows([values]))
+                db.session.commit()
+                inserted.append(values)
+            except IntegrityError:
+                db.session.rollback()
+                existing += 1
+        new_rows = inserted
+    summary['created'] += len(new_rows)
+    summary['existing'] += existing
+    if rule_network.loaded:
+        for rule_id, values in zip(rule_ids, new_rows):
+            rule_network.add_rule(rule_id, FlatRule.from_bytes(values['ast_binary']).to_ast())
+
+def _insert_rows(rows: List[dict]) -> List[int]:
+    """Insert rules and their attribute entries with one executemany per table, returning the new ids in order"""
+    columns = [{key: value for key, value in values.items() if key != 'attributes'} for values in rows]
+    rule_ids = db.session.scalars(insert(Rule).returning(Rule.id, sort_by_parameter_order=True), columns).all()
+    attribute_rows = [{'rule_id': rule_id, 'attribute': attribute}
+                      for rule_id, values in zip(rule_ids, rows) for attribute in values['attributes']]
+    if attribute_rows:
+        db.session.execute(insert(RuleAttribute), attribute_rows)
+    return rule_ids
+
+@click.command('import-rules')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(BULK_FORMATS), default=None,
+              help='Input format; defaults to the file extension, then NDJSON.')
+@click.option('--workers', type=int, default=None, help='Parser processes; defaults to PARSE_WORKERS.')
+@click.option('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help='Rules parsed and written per transaction.')
+@with_appcontext
+def import_rules_command(path, format, workers, chunk_size):
+    """Import rule strings from an NDJSON or CSV file."""
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    if workers is None:
+        workers = current_app.config['PARSE_WORKERS']
+    with open(path, 'rb') as stream:
+        summary = import_rules(read_rule_strings(stream, format), workers, chunk_size)
+    for error in summary['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"{summary['created']} rules created, {summary['existing']} already stored, "
+               f"{len(summary['errors'])} errors")
+    if 'error' in summary:
+        raise click.ClickException(f"Import stopped after line {summary['last_line']}: {summary['error']}")
@@ -0,0 +1,181 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+from compiler import compile_ast
+from evaluator import operators
+from flat import FlatRule
+from node import Node
+from optimizer import OperandStatistics, order_ast, record_statistics
+
+# Every STATISTICS_SAMPLE_INTERVAL-th evaluation of a rule records per-condition statistics,
+# and every REOPTIMIZE_INTERVAL-th one reorders the rule from the statistics gathered so far
+STATISTICS_SAMPLE_INTERVAL = 100
+REOPTIMIZE_INTERVAL = 1000
+
+class PreparedRule:
+    """
+    A stored rule that is ready to run: the rule, the evaluation plan reordered from runtime
+    statistics, and the compiled form of that plan built on first use.
+
+    The rule and plan are held as flattened FlatRule arrays; ast and plan rebuild the trees.
+    The rule may be given as an AST or already flattened.
+
+    Short-circuiting decides which conditions run, and so whether a missing attribute raises.
+    The reordered plan is therefore only used for records on which no condition can raise,
+    where every order gives the same result; other records run the rule in its original order.
+    """
+    def __init__(self, rule_id, ast: Union[Node, FlatRule], statistics: Optional[OperandStatistics] = None):
+        self.rule_id = rule_id
+        self.rule = ast if isinstance(ast, FlatRule) else FlatRule.from_ast(ast)
+        self.flat_plan = self.rule
+        self.decisions = []
+        self.statistics = statistics
+        self.evaluations = 0
+        self._compiled = None
+        self._compiled_rule = None
+
+    @property
+    def ast(self) -> Node:
+        return self.rule.to_ast()
+
+    @property
+    def plan(self) -> Node:
+        return self.flat_plan.to_ast()
+
+    @property
+    def compiled(self) -> Callable[[dict], bool]:
+        if self._compiled is None:
+            self._compiled = self.compiled_rule if self.flat_plan is self.rule else compile_ast(self.plan)
+        return self._compiled
+
+    @property
+    def compiled_rule(self) -> Callable[[dict], bool]:
+        if self._compiled_rule is None:
+            self._compiled_rule = compile_ast(self.ast)
+        return self._compiled_rule
+
+    def evaluate(self, data: dict, engine: str = 'interpreted') -> bool:
+        """Evaluate the rule with the given engine, sampling statistics and reoptimizing periodically"""
+        if self.statistics is not None:
+            self.evaluations += 1
+            try:
+                if self.evaluations % STATISTICS_SAMPLE_INTERVAL == 0:
+                    record_statistics(self.ast, data, self.statistics)
+                if self.evaluations % REOPTIMIZE_INTERVAL == 0:
+                    self.reoptimize()
+            except Exception as e:
+                # Statistics only tune the plan; the rule is still evaluated in its current order
+                print(f"Error sampling statistics of rule {self.rule_id}: {e}")
+        compiled = engine == 'compiled'
+        if self.flat_plan is not self.rule and conditions_cannot_raise(self.rule.attributes, data):
+            try:
+                return self.compiled(data) if compiled else self.flat_plan.evaluate(data)
+            except Exception:
+                # Let the original order decide what is returned or raised
+                pass
+        return self.compiled_rule(data) if compiled else self.rule.evaluate(data)
+
+    def reoptimize(self):
+        """Reorder the plan from the statistics gathered so far, keeping the reasons for each choice"""
+        if not all(name in operators for name in self.rule.operators):
+            # An unsupported operator raises whenever it is reached, so the order is kept
+            return
+        decisions = []
+        plan = order_ast(self.ast, self.statistics.pass_rates(), self.statistics.costs(), decisions,
+                         self.statistics.failure_rates())
+        self.flat_plan = FlatRule.from_ast(plan)
+        self.decisions = decisions
+        self._compiled = None
+
+    def __repr__(self):
+        return f'<PreparedRule {self.rule_id}>'
+
+def conditions_cannot_raise(attributes, data) -> bool:
+    """
+    Whether data has every attribute with a value that evaluate_condition compares without
+    raising: a string, or a number that converts to float
+    """
+    for attribute in attributes:
+        if attribute not in data:
+            return False
+        value = data[attribute]
+        if isinstance(value, (str, float)):
+            continue
+        if isinstance(value, int) and abs(value) <= sys.float_info.max:
+            continue
+        return False
+    return True
+
+class RuleCache:
+    """
+    Process-wide, size-bounded LRU cache of prepared rules keyed by rule id and version.
+
+    Invalidating a rule bumps its version, so an entry loaded concurrently with the
+    invalidation is stored under the old key and never served again.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        """Read the cache size from the app config"""
+        self.max_size = int(app.config.get('RULE_CACHE_SIZE', self.max_size))
+        self.clear()
+
+    def get_or_load(self, rule_id, loader: Callable[[int], Optional[PreparedRule]]) -> Optional[PreparedRule]:
+        """Return the cached rule, calling loader(rule_id) on a miss. Returns None if the loader finds nothing."""
+        with self._lock:
+            version = self._versions.get(rule_id, 0)
+            key = (rule_id, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = loader(rule_id)
+        if entry is None:
+            return None
+
+        with self._lock:
+            if self._versions.get(rule_id, 0) == version:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def invalidate(self, rule_id):
+        """Drop a rule from the cache after it is created, combined or modified"""
+        with self._lock:
+            version = self._versions.get(rule_id, 0)
+            self._entries.pop((rule_id, version), None)
+            self._versions[rule_id] = version + 1
+
+    def clear(self):
+        """Drop every cached rule and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,100 @@
+from typing import Callable
+from evaluator import operators
+from flat import FlatRule
+from node import Node, fold_tree
+
+ENGINES = ('compiled', 'interpreted')
+
+# Nested closures call each other one Python frame per level, so rules nested deeper than
+# this run on FlatRule's loop instead of hitting the recursion limit
+MAX_CLOSURE_DEPTH = 200
+
+def compile_ast(ast: Node) -> Callable[[dict], bool]:
+    """
+    Compile an Abstract Syntax Tree (AST) of a rule into a single callable taking input data.
+    Rules nested deeper than MAX_CLOSURE_DEPTH compile to FlatRule.evaluate, which gives the
+    same results and raises the same errors.
+    """
+    evaluate, depth = fold_tree(ast, _operator_children, _compile_node)
+    if depth > MAX_CLOSURE_DEPTH:
+        return FlatRule.from_ast(ast).evaluate
+    return evaluate
+
+def _operator_children(node: Node):
+    return node.children if node.type == 'operator' else None
+
+def _compile_node(node: Node, compiled_children):
+    """Build the closure of one node from its children's (closure, depth) pairs"""
+    if node.type == 'operand':
+        return compile_condition(node), 1
+    elif node.type != 'operator':
+        raise ValueError(f'Unknown node type {node.type}')
+    if node.value not in ('AND', 'OR'):
+        raise ValueError(f'Unknown operator {node.value}')
+    depth = 1 + max((depth for _, depth in compiled_children), default=0)
+    if depth > MAX_CLOSURE_DEPTH:
+        # compile_ast replaces the whole rule, so the closures above this node are never called
+        return None, depth
+    children = tuple(child for child, _ in compiled_children)
+    if len(children) == 1:
+        return children[0], depth
+    if node.value == 'AND':
+        if len(children) == 2:
+            left, right = children
+            def evaluate_and(data):
+                return left(data) and right(data)
+            return evaluate_and, depth
+        def evaluate_all(data):
+            for child in children:
+                if not child(data):
+                    return False
+            return True
+        return evaluate_all, depth
+    else:
+        if len(children) == 2:
+            left, right = children
+            def evaluate_or(data):
+                return left(data) or right(data)
+            return evaluate_or, depth
+        def evaluate_any(data):
+            for child in children:
+                if child(data):
+                    return True
+            return False
+        return evaluate_any, depth
+
+def compile_condition(node: Node) -> Callable[[dict], bool]:
+    """Compile a condition of a rule, binding its operator and coercing its constant up front"""
+    attribute = node.attribute
+    op_func = operators.get(node.operator)
+    if not op_func:
+        raise ValueError(f"Unsupported operator: {node.operator}")
+
+    string_constant = str(node.constant).strip("'\"")
+    try:
+        numeric_constant = float(node.constant)
+    except ValueError:
+        numeric_constant = None
+
+    if numeric_constant is None:
+        # The constant is never numeric, so every comparison is a string comparison
+        def evaluate_string_condition(data):
+            if attribute not in data:
+                raise KeyError(f"Attribute '{attribute}' not found in data")
+            attribute_value = data[attribute]
+            try:
+                attribute_value = float(attribute_value)
+            except ValueError:
+                pass
+            return op_func(str(attribute_value), string_constant)
+        return evaluate_string_condition
+
+    def evaluate_numeric_condition(data):
+        if attribute not in data:
+            raise KeyError(f"Attribute '{attribute}' not found in data")
+        attribute_value = data[attribute]
+        try:
+            return op_func(float(attribute_value), numeric_constant)
+        except ValueError:
+            return op_func(str(attribute_value), string_constant)
+    return evaluate_numeric_condition
@@ -1,4 +1,6 @@
 import operator
+from functools import partial
+from typing import Callable, List, Tuple, Union
 from node import Node
 
 operators = {
@@ -11,20 +13,50 @@ operators = {
 }
 
 def evaluate_ast(ast, data):
-    """Evaluates an Abstract Syntax Tree of a rule against input data."""
+    """
+    Evaluates an Abstract Syntax Tree of a rule against input data.
+    AND and OR short-circuit: children are evaluated in order until one decides the result.
+    The tree is walked with an explicit stack, so deeply nested rules do not hit the recursion limit.
+    """
     if ast.type == 'operand':
         return evaluate_condition(ast, data)
-    elif ast.type == 'operator':
-        left = evaluate_ast(ast.left, data)
-        right = evaluate_ast(ast.right, data)
-        if ast.value == 'AND':
-            return left and right
-        elif ast.value == 'OR':
-            return left or right
+    children, is_and = _operator_frame(ast)
+    index = 0
+    # Suspended AND/OR nodes above the current one: (children, index of the next child, is it an AND)
+    stack = []
+    while True:
+        if index < len(children):
+            child = children[index]
+            index += 1
+            if child.type != 'operand':
+                stack.append((children, index, is_and))
+                children, is_and = _operator_frame(child)
+                index = 0
+                continue
+            value = evaluate_condition(child, data)
+            if value == is_and:
+                continue
+            # False under AND or true under OR decides the node
         else:
-            raise ValueError(f'Unknown operator {ast.value}')
-    else:
-        raise ValueError(f'Unknown node type {ast.type}')
+            # No child decided the node
+            value = is_and
+        # The current node is finished; resume the nearest ancestor it does not decide as well
+        while True:
+            if not stack:
+                return value
+            children, index, is_and = stack.pop()
+            if value == is_and:
+                break
+
+def _operator_frame(node):
+    """Return the children of an AND/OR node and whether it is an AND"""
+    if node.type != 'operator':
+        raise ValueError(f'Unknown node type {node.type}')
+    if node.value == 'AND':
+        return node.children, True
+    elif node.value == 'OR':
+        return node.children, False
+    raise ValueError(f'Unknown operator {node.value}')
 
 def evaluate_condition(node, data):
     """Evaluates a condition of a rule against input data."""
@@ -50,4 +82,28 @@ def evaluate_condition(node, data):
     if not op_func:
         raise ValueError(f"Unsupported operator: {operator_str}")
 
-    return op_func(attribute_value, constant_value)
\ No newline at end of file
+    return op_func(attribute_value, constant_value)
+
+def evaluate_batch(rule: Union[Node, Callable[[dict], bool]], records: List[dict]) -> Tuple[list, list]:
+    """
+    Evaluates a rule against many input records. The rule is an AST or a compiled rule.
+    Returns the per-record results (None where a record failed) and a list of per-record errors.
+    """
+    evaluate = rule if callable(rule) else partial(evaluate_ast, rule)
+    results = []
+    errors = []
+    for index, data in enumerate(records):
+        try:
+            results.append(evaluate(data))
+        except Exception as e:
+            results.append(None)
+            errors.append({'index': index, 'error': str(e)})
+    return results, errors
+
+def results_to_bitmap(results: list) -> bytes:
+    """Packs batch results into a bitmap, bit i (LSB first) set when record i evaluated to true."""
+    bitmap = bytearray((len(results) + 7) // 8)
+    for index, result in enumerate(results):
+        if result:
+            bitmap[index >> 3] |= 1 << (index & 7)
+    return bytes(bitmap)
\ No newline at end of file
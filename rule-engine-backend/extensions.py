@@ -1,3 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
+from cache import RuleCache
+from matcher import RuleNetwork
+from optimizer import OperandStatistics
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+rule_cache = RuleCache()
+rule_network = RuleNetwork()
+operand_statistics = OperandStatistics()
\ No newline at end of file
@@ -0,0 +1,218 @@
+import json
+import struct
+import sys
+from array import array
+from evaluator import operators
+from node import Node, make_node
+from utils import ast_to_dict, dict_to_ast
+
+# Opcodes of the postfix entries
+OP_CONDITION = 0
+OP_AND = 1
+OP_OR = 2
+
+OPCODES = {'AND': OP_AND, 'OR': OP_OR}
+OPERATOR_NAMES = {OP_AND: 'AND', OP_OR: 'OR'}
+
+NO_PARENT = -1
+NO_INDEX = -1  # Table index of AND/OR entries, which have no condition
+
+FORMAT_VERSION = 1
+MAGIC = b'RFLT'
+HEADER = struct.Struct('<4sBI')  # magic, format version, number of entries
+ARRAY_TYPES = ('b', 'i', 'i', 'i', 'i', 'i')
+
+class FlatRule:
+    """
+    A rule stored as parallel arrays in postfix order, one entry per AST node: the subtree of
+    each child comes before its parent and siblings keep their order.
+
+    Conditions refer to per-rule tables of attribute names, comparison operators and constants.
+    Every entry also records the index of its parent, so a child that decides an AND or OR jumps
+    straight to the parent; evaluation short-circuits exactly like evaluate_ast.
+    """
+    __slots__ = ('opcodes', 'parents', 'child_counts', 'attribute_indexes', 'operator_indexes',
+                 'constant_indexes', 'attributes', 'operators', 'constants', '_operator_functions',
+                 '_numeric_constants', '_string_constants')
+
+    def __init__(self, opcodes, parents, child_counts, attribute_indexes, operator_indexes, constant_indexes,
+                 attributes, operator_names, constants):
+        self.opcodes = opcodes
+        self.parents = parents
+        self.child_counts = child_counts
+        self.attribute_indexes = attribute_indexes
+        self.operator_indexes = operator_indexes
+        self.constant_indexes = constant_indexes
+        self.attributes = tuple(attributes)
+        self.operators = tuple(operator_names)
+        self.constants = tuple(constants)
+        # Resolve operators and coerce constants once per rule instead of once per evaluation
+        self._operator_functions = tuple(operators.get(name) for name in self.operators)
+        numeric_constants = []
+        for constant in self.constants:
+            try:
+                numeric_constants.append(float(constant))
+            except ValueError:
+                numeric_constants.append(None)
+        self._numeric_constants = tuple(numeric_constants)
+        self._string_constants = tuple(str(constant).strip("'\"") for constant in self.constants)
+
+    @classmethod
+    def from_ast(cls, ast: Node) -> 'FlatRule':
+        """Flatten an Abstract Syntax Tree (AST) into postfix arrays"""
+        opcodes, parents, child_counts, attribute_indexes, operator_indexes, constant_indexes = (
+            array(typecode) for typecode in ARRAY_TYPES)
+        tables = ({}, {}, {})
+
+        def table_index(table, value):
+            # The value's type is part of the key so that 1 and '1' keep separate entries
+            return table.setdefault((value, value.__class__), len(table))
+
+        # Entries are (node, indexes of its parent's children, indexes of its own children once expanded)
+        stack = [(ast, None, None)]
+        while stack:
+            node, siblings, children = stack.pop()
+            if node.type == 'operator' and children is None:
+                if node.value not in OPCODES:
+                    raise ValueError(f'Unknown operator {node.value}')
+                children = []
+                stack.append((node, siblings, children))
+                for child in reversed(node.children):
+                    stack.append((child, children, None))
+                continue
+
+            index = len(opcodes)
+            if node.type == 'operand':
+                opcodes.append(OP_CONDITION)
+                child_counts.append(0)
+                attribute_indexes.append(table_index(tables[0], node.attribute))
+                operator_indexes.append(table_index(tables[1], node.operator))
+                constant_indexes.append(table_index(tables[2], node.constant))
+            elif node.type == 'operator':
+                opcodes.append(OPCODES[node.value])
+                child_counts.append(len(children))
+                attribute_indexes.append(NO_INDEX)
+                operator_indexes.append(NO_INDEX)
+                constant_indexes.append(NO_INDEX)
+                for child_index in children:
+                    parents[child_index] = index
+            else:
+                raise ValueError(f'Unknown node type {node.type}')
+            parents.append(NO_PARENT)
+            if siblings is not None:
+                siblings.append(index)
+
+        attributes, operator_names, constants = ([value for value, _ in table] for table in tables)
+        return cls(opcodes, parents, child_counts, attribute_indexes, operator_indexes, constant_indexes,
+                   attributes, operator_names, constants)
+
+    @classmethod
+    def from_dict(cls, ast_dict: dict) -> 'FlatRule':
+        """Flatten the output of ast_to_dict"""
+        return cls.from_ast(dict_to_ast(ast_dict))
+
+    def to_ast(self) -> Node:
+        """Rebuild the Abstract Syntax Tree (AST), sharing nodes through the intern table"""
+        stack = []
+        for index, opcode in enumerate(self.opcodes):
+            if opcode == OP_CONDITION:
+                stack.append(make_node(
+                    'operand',
+                    attribute=self.attributes[self.attribute_indexes[index]],
+                    operator=self.operators[self.operator_indexes[index]],
+                    constant=self.constants[self.constant_indexes[index]]
+                ))
+            else:
+                count = self.child_counts[index]
+                children = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                stack.append(make_node('operator', OPERATOR_NAMES[opcode], children=children))
+        return stack[-1]
+
+    def to_dict(self) -> dict:
+        """Convert to the dictionary form produced by ast_to_dict"""
+        return ast_to_dict(self.to_ast())
+
+    def evaluate(self, data: dict) -> bool:
+        """Evaluate the rule against input data with a single loop over the postfix entries"""
+        opcodes = self.opcodes
+        parents = self.parents
+        attributes = self.attributes
+        attribute_indexes = self.attribute_indexes
+        constant_indexes = self.constant_indexes
+        operator_indexes = self.operator_indexes
+        numeric_constants = self._numeric_constants
+        string_constants = self._string_constants
+        operator_functions = self._operator_functions
+        index = 0
+        while True:
+            opcode = opcodes[index]
+            if opcode == OP_CONDITION:
+                attribute = attributes[attribute_indexes[index]]
+                if attribute not in data:
+                    raise KeyError(f"Attribute '{attribute}' not found in data")
+                attribute_value = data[attribute]
+                constant_index = constant_indexes[index]
+                # Compare as numbers when both sides convert, as strings otherwise
+                constant_value = numeric_constants[constant_index]
+                try:
+                    attribute_value = float(attribute_value)
+                except ValueError:
+                    constant_value = None
+                if constant_value is None:
+                    attribute_value = str(attribute_value)
+                    constant_value = string_constants[constant_index]
+                op_func = operator_functions[operator_indexes[index]]
+                if not op_func:
+                    raise ValueError(f"Unsupported operator: {self.operators[operator_indexes[index]]}")
+                value = op_func(attribute_value, constant_value)
+            else:
+                # Reached without being decided by a child: every child of an AND was true,
+                # or every child of an OR was false
+                value = opcode == OP_AND
+            parent = parents[index]
+            # A child that is false under AND or true under OR decides its parent, and maybe further ancestors
+            while parent != NO_PARENT and value != (opcodes[parent] == OP_AND):
+                index = parent
+                parent = parents[index]
+            if parent == NO_PARENT:
+                return value
+            index += 1
+
+    def to_bytes(self) -> bytes:
+        """Serialize to a compact byte string: a header, the arrays, then the tables as JSON"""
+        arrays = (self.opcodes, self.parents, self.child_counts, self.attribute_indexes, self.operator_indexes,
+                  self.constant_indexes)
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(self.opcodes))]
+        for values in arrays:
+            if sys.byteorder == 'big':
+                values = array(values.typecode, values)
+                values.byteswap()
+            parts.append(values.tobytes())
+        parts.append(json.dumps([self.attributes, self.operators, self.constants],
+                                separators=(',', ':')).encode('utf-8'))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'FlatRule':
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Not a serialized rule of a supported format version')
+        offset = HEADER.size
+        arrays = []
+        for typecode in ARRAY_TYPES:
+            values = array(typecode)
+            size = count * values.itemsize
+            values.frombytes(data[offset:offset + size])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            arrays.append(values)
+            offset += size
+        attributes, operator_names, constants = json.loads(data[offset:].decode('utf-8'))
+        return cls(*arrays, attributes, operator_names, constants)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __repr__(self):
+        return f'<FlatRule {len(self.opcodes)} entries>'
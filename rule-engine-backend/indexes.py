@@ -0,0 +1,167 @@
+from bisect import bisect_left, bisect_right
+from typing import Callable, Optional
+
+THRESHOLD_OPERATORS = ('>', '>=', '<', '<=')
+EQUALITY_OPERATORS = ('=', '!=')
+
+def numeric_threshold(operator_str, constant) -> Optional[float]:
+    """Return the numeric threshold of a >, >=, < or <= condition, or None if it has none"""
+    if operator_str not in THRESHOLD_OPERATORS:
+        return None
+    try:
+        threshold = float(constant)
+    except ValueError:
+        return None
+    # NaN has no place in a sorted array
+    return threshold if threshold == threshold else None
+
+class ThresholdIndex:
+    """
+    Sorted numeric thresholds of the >, >=, < and <= conditions on one attribute.
+
+    For a numeric value a single bisect per operator splits that operator's thresholds into
+    the satisfied and unsatisfied conditions. Non-numeric values are compared as strings by
+    each condition's compiled fallback, as evaluate_condition does.
+    """
+    def __init__(self):
+        # operator -> (sorted thresholds, condition ids in the same order)
+        self._thresholds = {operator_str: ([], []) for operator_str in THRESHOLD_OPERATORS}
+        self._fallbacks = {}
+
+    def __len__(self):
+        return len(self._fallbacks)
+
+    def copy(self) -> 'ThresholdIndex':
+        index = ThresholdIndex()
+        index._thresholds = {operator_str: (list(thresholds), list(condition_ids))
+                             for operator_str, (thresholds, condition_ids) in self._thresholds.items()}
+        index._fallbacks = dict(self._fallbacks)
+        return index
+
+    def add(self, condition_id: int, operator_str: str, constant, condition: Callable[[dict], bool]):
+        threshold = float(constant)
+        thresholds, condition_ids = self._thresholds[operator_str]
+        position = bisect_right(thresholds, threshold)
+        thresholds.insert(position, threshold)
+        condition_ids.insert(position, condition_id)
+        self._fallbacks[condition_id] = condition
+
+    def remove(self, condition_id: int, operator_str: str, constant):
+        threshold = float(constant)
+        thresholds, condition_ids = self._thresholds[operator_str]
+        position = bisect_left(thresholds, threshold)
+        while condition_ids[position] != condition_id:
+            position += 1
+        del thresholds[position]
+        del condition_ids[position]
+        del self._fallbacks[condition_id]
+
+    def evaluate(self, data: dict, attribute: str, results: list):
+        """Write the result of every indexed condition on attribute into results"""
+        try:
+            value = float(data[attribute])
+        except ValueError:
+            for condition_id, condition in self._fallbacks.items():
+                results[condition_id] = condition(data)
+            return
+        except (TypeError, OverflowError):
+            # evaluate_condition raises on these values too, so the conditions stay unevaluated
+            return
+
+        if value != value:
+            # NaN satisfies no threshold
+            for condition_id in self._fallbacks:
+                results[condition_id] = False
+            return
+
+        for operator_str, (thresholds, condition_ids) in self._thresholds.items():
+            if not condition_ids:
+                continue
+            if operator_str == '>':
+                split = bisect_left(thresholds, value)
+                satisfied, unsatisfied = condition_ids[:split], condition_ids[split:]
+            elif operator_str == '>=':
+                split = bisect_right(thresholds, value)
+                satisfied, unsatisfied = condition_ids[:split], condition_ids[split:]
+            elif operator_str == '<':
+                split = bisect_right(thresholds, value)
+                satisfied, unsatisfied = condition_ids[split:], condition_ids[:split]
+            else:
+                split = bisect_left(thresholds, value)
+                satisfied, unsatisfied = condition_ids[split:], condition_ids[:split]
+            for condition_id in satisfied:
+                results[condition_id] = True
+            for condition_id in unsatisfied:
+                results[condition_id] = False
+
+class EqualityIndex:
+    """
+    Inverted index of the = and != conditions on one attribute.
+
+    Maps each compared value to the conditions it satisfies (for =) or fails (for !=), so one
+    dict lookup resolves every equality condition on the attribute. Numeric constants are keyed
+    by their float value and other constants by their unquoted string, mirroring the
+    float-then-string comparison of evaluate_condition.
+    """
+    def __init__(self):
+        # operator -> {float or str key: set of condition ids}
+        self._numeric = {operator_str: {} for operator_str in EQUALITY_OPERATORS}
+        self._string = {operator_str: {} for operator_str in EQUALITY_OPERATORS}
+        self._condition_ids = {operator_str: set() for operator_str in EQUALITY_OPERATORS}
+
+    def __len__(self):
+        return sum(len(condition_ids) for condition_ids in self._condition_ids.values())
+
+    def copy(self) -> 'EqualityIndex':
+        index = EqualityIndex()
+        for source, target in ((self._numeric, index._numeric), (self._string, index._string)):
+            for operator_str, keys in source.items():
+                target[operator_str] = {key: set(condition_ids) for key, condition_ids in keys.items()}
+        index._condition_ids = {operator_str: set(condition_ids)
+                                for operator_str, condition_ids in self._condition_ids.items()}
+        return index
+
+    def add(self, condition_id: int, operator_str: str, constant, condition: Callable[[dict], bool] = None):
+        keys, key = self._key(operator_str, constant)
+        keys.setdefault(key, set()).add(condition_id)
+        self._condition_ids[operator_str].add(condition_id)
+
+    def remove(self, condition_id: int, operator_str: str, constant):
+        keys, key = self._key(operator_str, constant)
+        condition_ids = keys[key]
+        condition_ids.discard(condition_id)
+        if not condition_ids:
+            del keys[key]
+        self._condition_ids[operator_str].discard(condition_id)
+
+    def evaluate(self, data: dict, attribute: str, results: list):
+        """Write the result of every indexed condition on attribute into results"""
+        value = data[attribute]
+        try:
+            number = float(value)
+            string = str(number)
+        except ValueError:
+            number = None
+            string = str(value)
+        except (TypeError, OverflowError):
+            # evaluate_condition raises on these values too, so the conditions stay unevaluated
+            return
+
+        for operator_str, condition_ids in self._condition_ids.items():
+            if not condition_ids:
+                continue
+            # The value equals the constants found under its keys and differs from all others
+            is_equal = operator_str == '='
+            for condition_id in condition_ids:
+                results[condition_id] = not is_equal
+            for condition_id in self._string[operator_str].get(string, ()):
+                results[condition_id] = is_equal
+            if number is not None:
+                for condition_id in self._numeric[operator_str].get(number, ()):
+                    results[condition_id] = is_equal
+
+    def _key(self, operator_str, constant):
+        try:
+            return self._numeric[operator_str], float(constant)
+        except ValueError:
+            return self._string[operator_str], str(constant).strip("'\"")
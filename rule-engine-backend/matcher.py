@@ -0,0 +1,321 @@
+import threading
+from operator import itemgetter
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from compiler import MAX_CLOSURE_DEPTH, compile_condition
+from flat import NO_PARENT, OP_AND, OP_CONDITION, FlatRule
+from indexes import EQUALITY_OPERATORS, EqualityIndex, ThresholdIndex, numeric_threshold
+from node import Node, fold_tree
+
+class _Snapshot(NamedTuple):
+    """Immutable copy of the network that match() reads without taking the lock"""
+    condition_count: int
+    indexes: tuple        # (attribute, index) pairs
+    by_attribute: tuple   # (attribute, ((condition id, compiled condition), ...)) pairs
+    postings: tuple       # condition id -> ids of the rules watching it
+    unwatched: tuple      # ids of the rules derived for every record
+    plans: dict           # rule id -> compiled plan
+
+class RuleNetwork:
+    """
+    Discrimination network over all stored rules for matching one record against every rule.
+
+    Every distinct (attribute, operator, constant) condition is evaluated once per record.
+    Each rule is posted under the conditions it watches: the first child of an AND, which
+    short-circuits to false when that child is false, and every child of an OR. Only the rules
+    posted under a condition that holds or could not be evaluated are derived from the shared
+    results; every other rule is false without being visited. The per-record cost therefore
+    grows with the number of distinct conditions and of rules reached, not with the number of
+    stored rules. Numeric >, >=, < and <= conditions are resolved together per
+    attribute through a ThresholdIndex, and = and != conditions through an EqualityIndex.
+
+    Matching reads an immutable snapshot of the network, rebuilt once after rules change, so
+    concurrent matches do not wait on each other or on rules being added.
+    """
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._condition_ids = {}     # (attribute, operator, constant) -> condition id
+        self._condition_keys = {}    # condition id -> (attribute, operator, constant)
+        self._condition_refs = []    # condition id -> number of rules using it
+        self._postings = []          # condition id -> set of ids of the rules watching it
+        self._unwatched = set()      # ids of rules with an empty AND, which no condition can falsify
+        self._by_attribute = {}      # attribute -> {condition id: compiled condition}
+        self._indexes = {}           # (attribute, index type) -> ThresholdIndex or EqualityIndex
+        self._rules = {}             # rule id -> (compiled plan, condition ids, watched condition ids)
+        self._snapshot = None        # _Snapshot of the current rules, None once they change
+
+    def load(self, rules: Iterable[Tuple[int, Node]]):
+        """Build the network from (rule id, AST) pairs unless it is already built"""
+        with self._lock:
+            if self.loaded:
+                return
+            for rule_id, ast in rules:
+                self._add_rule(rule_id, ast)
+            self.loaded = True
+            self._snapshot = None
+
+    def add_rule(self, rule_id, ast: Node):
+        """Add or replace a rule. Ignored until the network has been loaded."""
+        with self._lock:
+            if self.loaded:
+                self._add_rule(rule_id, ast)
+                self._snapshot = None
+
+    def remove_rule(self, rule_id):
+        with self._lock:
+            self._remove_rule(rule_id)
+            self._snapshot = None
+
+    def clear(self):
+        with self._lock:
+            self.loaded = False
+            self._condition_ids.clear()
+            self._condition_keys.clear()
+            self._condition_refs.clear()
+            self._postings.clear()
+            self._unwatched.clear()
+            self._by_attribute.clear()
+            self._indexes.clear()
+            self._rules.clear()
+            self._snapshot = None
+
+    def match(self, data: dict) -> Tuple[List[int], int]:
+        """
+        Match a record against every rule.
+        Returns the ids of the rules that fire and the number of rules that could not be
+        evaluated because a condition failed (for example a missing attribute).
+        """
+        snapshot = self._current_snapshot()
+        results = self._evaluate_conditions(snapshot, data)
+        # A rule whose watched conditions are all false is false, see _watched_conditions
+        reached = set(snapshot.unwatched)
+        for condition_id, result in enumerate(results):
+            if result is not False:
+                reached.update(snapshot.postings[condition_id])
+        matched = []
+        unevaluated = 0
+        plans = snapshot.plans
+        for rule_id in reached:
+            result = plans[rule_id](results)
+            if result is None:
+                unevaluated += 1
+            elif result:
+                matched.append(rule_id)
+        return sorted(matched), unevaluated
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'rules': len(self._rules),
+                'conditions': len(self._condition_ids),
+                'threshold_conditions': sum(
+                    len(index) for index in self._indexes.values() if isinstance(index, ThresholdIndex)
+                ),
+                'equality_conditions': sum(
+                    len(index) for index in self._indexes.values() if isinstance(index, EqualityIndex)
+                ),
+                'attributes': len(self._by_attribute.keys() | {attribute for attribute, _ in self._indexes})
+            }
+
+    def _current_snapshot(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = self._build_snapshot()
+        return snapshot
+
+    def _build_snapshot(self) -> _Snapshot:
+        return _Snapshot(
+            condition_count=len(self._condition_refs),
+            indexes=tuple((attribute, index.copy()) for (attribute, _), index in self._indexes.items()),
+            by_attribute=tuple((attribute, tuple(conditions.items()))
+                               for attribute, conditions in self._by_attribute.items()),
+            postings=tuple(tuple(rule_ids) for rule_ids in self._postings),
+            unwatched=tuple(self._unwatched),
+            plans={rule_id: entry[0] for rule_id, entry in self._rules.items()}
+        )
+
+    @staticmethod
+    def _evaluate_conditions(snapshot: _Snapshot, data: dict) -> list:
+        # None marks a condition that could not be evaluated for this record
+        results = [None] * snapshot.condition_count
+        for attribute, index in snapshot.indexes:
+            if attribute in data:
+                index.evaluate(data, attribute, results)
+        for attribute, conditions in snapshot.by_attribute:
+            if attribute not in data:
+                continue
+            for condition_id, condition in conditions:
+                try:
+                    results[condition_id] = condition(data)
+                except (TypeError, ValueError, OverflowError):
+                    pass
+        return results
+
+    def _add_rule(self, rule_id, ast: Node):
+        self._remove_rule(rule_id)
+        condition_ids = []
+        try:
+            plan = self._compile_plan(ast, condition_ids)
+        except Exception as e:
+            # A rule that cannot be compiled can never fire, so leave it out of the network
+            # rather than let one stored rule stop the network from loading
+            self._release_conditions(condition_ids)
+            print(f"Skipping rule {rule_id} in rule network: {e}")
+            return
+        watched_ids = set()
+        for node in self._watched_conditions(ast):
+            if node is None:
+                self._unwatched.add(rule_id)
+            else:
+                watched_ids.add(self._condition_ids[(node.attribute, node.operator, node.constant)])
+        self._rules[rule_id] = (plan, condition_ids, watched_ids)
+        for condition_id in watched_ids:
+            self._postings[condition_id].add(rule_id)
+
+    def _remove_rule(self, rule_id):
+        entry = self._rules.pop(rule_id, None)
+        if entry is not None:
+            for condition_id in entry[2]:
+                self._postings[condition_id].discard(rule_id)
+            self._unwatched.discard(rule_id)
+            self._release_conditions(entry[1])
+
+    def _release_conditions(self, condition_ids: list):
+        for condition_id in condition_ids:
+            self._condition_refs[condition_id] -= 1
+            if self._condition_refs[condition_id] == 0:
+                key = self._condition_keys.pop(condition_id)
+                del self._condition_ids[key]
+                attribute, operator_str, constant = key
+                index_type = self._index_type(operator_str, constant)
+                if index_type is not None:
+                    index = self._indexes[(attribute, index_type)]
+                    index.remove(condition_id, operator_str, constant)
+                    if not len(index):
+                        del self._indexes[(attribute, index_type)]
+                else:
+                    conditions = self._by_attribute[attribute]
+                    del conditions[condition_id]
+                    if not conditions:
+                        del self._by_attribute[attribute]
+
+    def _condition_id(self, node: Node) -> int:
+        key = (node.attribute, node.operator, node.constant)
+        condition_id = self._condition_ids.get(key)
+        if condition_id is None:
+            condition = compile_condition(node)
+            condition_id = len(self._condition_refs)
+            self._condition_ids[key] = condition_id
+            self._condition_keys[condition_id] = key
+            self._condition_refs.append(0)
+            self._postings.append(set())
+            index_type = self._index_type(node.operator, node.constant)
+            if index_type is not None:
+                index = self._indexes.setdefault((node.attribute, index_type), index_type())
+                index.add(condition_id, node.operator, node.constant, condition)
+            else:
+                self._by_attribute.setdefault(node.attribute, {})[condition_id] = condition
+        self._condition_refs[condition_id] += 1
+        return condition_id
+
+    @staticmethod
+    def _index_type(operator_str, constant):
+        """Pick the index that resolves a condition, or None to evaluate it on its own"""
+        if numeric_threshold(operator_str, constant) is not None:
+            return ThresholdIndex
+        if operator_str in EQUALITY_OPERATORS:
+            return EqualityIndex
+        return None
+
+    @staticmethod
+    def _watched_conditions(ast: Node) -> Iterable[Optional[Node]]:
+        """
+        Yield conditions such that the rule is false whenever they are all false. An AND is
+        false as soon as its first child is, and an OR is false once every child is. Yields
+        None for an AND without children, which is always true.
+        """
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            if node is None or node.type == 'operand':
+                yield node
+            elif node.value == 'AND':
+                stack.append(node.children[0] if node.children else None)
+            else:
+                stack.extend(node.children)
+
+    def _compile_plan(self, ast: Node, condition_ids: list):
+        """
+        Compile a rule into a function of the shared condition results, appending the ids of its
+        conditions from left to right. Like compile_ast, rules nested deeper than
+        MAX_CLOSURE_DEPTH get a loop over FlatRule entries instead of nested closures.
+        """
+        def compile_node(node: Node, compiled_children):
+            if node.type == 'operand':
+                condition_id = self._condition_id(node)
+                condition_ids.append(condition_id)
+                return itemgetter(condition_id), 1
+            elif node.type != 'operator':
+                raise ValueError(f'Unknown node type {node.type}')
+            if node.value not in ('AND', 'OR'):
+                raise ValueError(f'Unknown operator {node.value}')
+            depth = 1 + max((depth for _, depth in compiled_children), default=0)
+            if depth > MAX_CLOSURE_DEPTH:
+                return None, depth
+            children = tuple(child for child, _ in compiled_children)
+            # Short-circuit like evaluate_ast: a failed (None) child fails the whole node
+            if node.value == 'AND':
+                def match_and(results):
+                    for child in children:
+                        result = child(results)
+                        if not result:
+                            return result
+                    return True
+                return match_and, depth
+            def match_or(results):
+                for child in children:
+                    result = child(results)
+                    if result is None or result:
+                        return result
+                return False
+            return match_or, depth
+
+        plan, depth = fold_tree(ast, lambda node: node.children if node.type == 'operator' else None,
+                                compile_node)
+        if depth > MAX_CLOSURE_DEPTH:
+            return self._compile_flat_plan(ast, condition_ids)
+        return plan
+
+    @staticmethod
+    def _compile_flat_plan(ast: Node, condition_ids: list):
+        """Compile a rule into a loop over its FlatRule entries, as FlatRule.evaluate runs"""
+        rule = FlatRule.from_ast(ast)
+        opcodes = rule.opcodes
+        parents = rule.parents
+        # Condition entries are in postfix order, which lists the conditions from left to right
+        next_condition_id = iter(condition_ids).__next__
+        entry_condition_ids = [next_condition_id() if opcode == OP_CONDITION else None for opcode in opcodes]
+
+        def match_flat(results):
+            index = 0
+            while True:
+                condition_id = entry_condition_ids[index]
+                if condition_id is None:
+                    # Reached without being decided by a child
+                    value = opcodes[index] == OP_AND
+                else:
+                    value = results[condition_id]
+                    if value is None:
+                        # A failed condition fails every ancestor, as in the closures
+                        return None
+                parent = parents[index]
+                while parent != NO_PARENT and value != (opcodes[parent] == OP_AND):
+                    index = parent
+                    parent = parents[index]
+                if parent == NO_PARENT:
+                    return value
+                index += 1
+        return match_flat
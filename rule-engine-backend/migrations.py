@@ -0,0 +1,117 @@
+import json
+from sqlalchemy import inspect, text
+from extensions import db
+from flat import FlatRule
+from models import Rule
+from utils import canonical_hash
+
+def add_missing_columns():
+    """Add nullable columns declared on the Rule model that an existing table does not have yet"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns(Rule.__tablename__)}
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for column in Rule.__table__.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            connection.execute(text(
+                f'ALTER TABLE {preparer.quote(Rule.__tablename__)} '
+                f'ADD COLUMN {preparer.quote(column.name)} {column_type}'
+            ))
+            print(f"Added column {Rule.__tablename__}.{column.name}")
+
+def add_missing_indexes():
+    """Create the indexes declared on the Rule model that an existing table does not have yet"""
+    existing = {index['name'] for index in inspect(db.engine).get_indexes(Rule.__tablename__)}
+    with db.engine.begin() as connection:
+        for index in Rule.__table__.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind=connection)
+            print(f"Added index {index.name}")
+
+def backfill_ast_binary(batch_size=500):
+    """Encode ast_json into ast_binary for rows stored before the binary column existed"""
+    filled = 0
+    last_id = 0
+    while True:
+        rules = (Rule.query.filter(Rule.ast_binary.is_(None), Rule.id > last_id)
+                 .order_by(Rule.id).limit(batch_size).all())
+        if not rules:
+            break
+        for rule in rules:
+            try:
+                rule.ast_binary = FlatRule.from_dict(json.loads(rule.ast_json)).to_bytes()
+                filled += 1
+            except Exception as e:
+                # The row keeps working from ast_json
+                print(f"Skipping binary encoding of rule {rule.id}: {e}")
+        db.session.commit()
+        last_id = rules[-1].id
+    return filled
+
+def backfill_metadata(batch_size=500):
+    """Compute the metadata columns and attribute entries for rows stored before they existed"""
+    filled = 0
+    last_id = 0
+    while True:
+        rules = (Rule.query.filter(Rule.structural_hash.is_(None), Rule.id > last_id)
+                 .order_by(Rule.id).limit(batch_size).all())
+        if not rules:
+            break
+        for rule in rules:
+            try:
+                rule.set_metadata(rule.load_ast())
+                if rule.is_combined is None:
+                    # Older rows only record this in the rule string
+                    rule.is_combined = 'Combined Rule' in rule.rule_string
+                filled += 1
+            except Exception as e:
+                print(f"Skipping metadata of rule {rule.id}: {e}")
+        db.session.commit()
+        last_id = rules[-1].id
+    return filled
+
+def backfill_canonical_hash(batch_size=500):
+    """
+    Compute canonical_hash for rows stored before it existed. Of several equivalent rows only
+    the first gets the hash; the others keep working, are not returned by deduplication, and
+    record the first row in duplicate_of so they are not checked again.
+    """
+    pending = Rule.query.filter(Rule.canonical_hash.is_(None), Rule.duplicate_of.is_(None))
+    if pending.with_entities(Rule.id).first() is None:
+        return 0
+    taken = dict(db.session.query(Rule.canonical_hash, Rule.id).filter(Rule.canonical_hash.isnot(None)))
+    filled = 0
+    duplicates = 0
+    last_id = 0
+    while True:
+        rules = pending.filter(Rule.id > last_id).order_by(Rule.id).limit(batch_size).all()
+        if not rules:
+            break
+        for rule in rules:
+            try:
+                value = canonical_hash(rule.load_ast())
+            except Exception as e:
+                print(f"Skipping canonical hash of rule {rule.id}: {e}")
+                continue
+            if value in taken:
+                rule.duplicate_of = taken[value]
+                duplicates += 1
+                continue
+            rule.canonical_hash = value
+            taken[value] = rule.id
+            filled += 1
+        db.session.commit()
+        last_id = rules[-1].id
+    if duplicates:
+        print(f"{duplicates} rules are equivalent to an earlier rule and were left without a canonical hash")
+    return filled
+
+def upgrade_database():
+    """Bring an existing database up to the current models and backfill derived columns"""
+    add_missing_columns()
+    add_missing_indexes()
+    backfill_ast_binary()
+    backfill_metadata()
+    backfill_canonical_hash()
@@ -1,9 +1,92 @@
+import json
 from extensions import db
+from flat import FlatRule
+from node import Node
+from utils import AST_SCHEMA_VERSION, ast_metadata, ast_to_dict, canonical_hash, dict_to_ast
 
 class Rule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     rule_string = db.Column(db.Text, nullable=False)
     ast_json = db.Column(db.Text, nullable=False)
+    # FlatRule.to_bytes() of the AST; filled in for older rows by migrations.upgrade_database
+    ast_binary = db.Column(db.LargeBinary, nullable=True)
+    # Metadata computed from the AST when the rule is stored, see utils.ast_metadata.
+    # Nullable so that older tables can be upgraded in place; migrations backfill them.
+    operand_count = db.Column(db.Integer, nullable=True, index=True)
+    depth = db.Column(db.Integer, nullable=True, index=True)
+    structural_hash = db.Column(db.String(64), nullable=True, index=True)
+    is_combined = db.Column(db.Boolean, nullable=True, index=True)
+    # utils.canonical_hash of the AST; unique, so equivalent rules are stored once
+    canonical_hash = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    # Id of the earlier equivalent rule, for older rows left without a canonical_hash
+    duplicate_of = db.Column(db.Integer, nullable=True)
+    attribute_entries = db.relationship('RuleAttribute', cascade='all, delete-orphan',
+                                        order_by='RuleAttribute.attribute')
+
+    @staticmethod
+    def column_values(rule_string: str, ast: Node, is_combined: bool = False) -> dict:
+        """Values of the rule's columns for the given AST, plus the sorted 'attributes' it references"""
+        metadata = ast_metadata(ast)
+        return {
+            'rule_string': rule_string,
+            'ast_json': json.dumps(ast_to_dict(ast)),
+            'ast_binary': FlatRule.from_ast(ast).to_bytes(),
+            'operand_count': metadata['operand_count'],
+            'depth': metadata['depth'],
+            'structural_hash': metadata['structural_hash'],
+            'is_combined': is_combined,
+            'canonical_hash': canonical_hash(ast),
+            'attributes': metadata['attributes']
+        }
+
+    @classmethod
+    def from_ast(cls, rule_string: str, ast: Node, is_combined: bool = False) -> 'Rule':
+        """Build a rule storing its AST as JSON and binary, along with its metadata"""
+        values = cls.column_values(rule_string, ast, is_combined)
+        attributes = values.pop('attributes')
+        rule = cls(**values)
+        rule.attribute_entries = [RuleAttribute(attribute=attribute) for attribute in attributes]
+        return rule
+
+    def set_metadata(self, ast: Node):
+        """Compute the metadata columns and referenced attributes from the rule's AST"""
+        metadata = ast_metadata(ast)
+        self.operand_count = metadata['operand_count']
+        self.depth = metadata['depth']
+        self.structural_hash = metadata['structural_hash']
+        self.attribute_entries = [RuleAttribute(attribute=attribute) for attribute in metadata['attributes']]
+
+    @property
+    def attributes(self) -> list:
+        """Names of the attributes the rule's conditions refer to, sorted"""
+        return [entry.attribute for entry in self.attribute_entries]
+
+    def ast_dict(self) -> dict:
+        """The rule's AST in the compact dictionary schema, converting rows stored in the older form"""
+        ast_dict = json.loads(self.ast_json)
+        if ast_dict.get('version') != AST_SCHEMA_VERSION:
+            ast_dict = ast_to_dict(dict_to_ast(ast_dict))
+        return ast_dict
+
+    def load_flat(self) -> FlatRule:
+        """Load the rule's AST in flattened form, from the binary column when it is filled in"""
+        if self.ast_binary is not None:
+            return FlatRule.from_bytes(self.ast_binary)
+        return FlatRule.from_dict(json.loads(self.ast_json))
+
+    def load_ast(self) -> Node:
+        """Load the rule's Abstract Syntax Tree"""
+        return self.load_flat().to_ast()
 
     def __repr__(self):
         return f'<Rule {self.id}>'
+
+class RuleAttribute(db.Model):
+    """One attribute referenced by a rule, indexed so rules can be looked up by attribute"""
+    rule_id = db.Column(db.Integer, db.ForeignKey('rule.id'), primary_key=True)
+    attribute = db.Column(db.String(255), primary_key=True)
+
+    __table_args__ = (db.Index('ix_rule_attribute_attribute', 'attribute', 'rule_id'),)
+
+    def __repr__(self):
+        return f'<RuleAttribute {self.rule_id} {self.attribute}>'
@@ -1,26 +1,72 @@
+import threading
+import weakref
+from typing import Any, Callable, Iterable, Optional
+
+_set = object.__setattr__
+
 class Node:
     """
     Represents a node in the abstract syntax tree (AST).
+
+    Operator nodes are n-ary: a chain like `a AND b AND c` is one AND node with three children.
+    `left` and `right` remain available for binary code paths; on a node with more than two
+    children `right` is an equivalent node over the remaining children.
+
+    Nodes are immutable and hash by structure. The hash is computed once when the node is built,
+    so comparing subtrees with different hashes does not walk them. Build nodes with make_node
+    to share identical subtrees across rules.
     """
-    def __init__(self, type, value=None, left=None, right=None, attribute=None, operator=None, constant=None):
-        self.type = type  # 'operator' or 'operand'
-        self.value = value  # For 'operator' nodes: 'AND' or 'OR'
-        self.left = left
-        self.right = right
-        self.attribute = attribute  # For 'operand' nodes
-        self.operator = operator    # For 'operand' nodes
-        self.constant = constant    # For 'operand' nodes
+    __slots__ = ('type', 'value', 'children', 'attribute', 'operator', 'constant', '_hash', '__weakref__')
+
+    def __init__(self, type, value=None, left=None, right=None, attribute=None, operator=None, constant=None,
+                 children=None):
+        if children is None and (left is not None or right is not None):
+            children = [child for child in (left, right) if child is not None]
+        if children is not None:
+            children = tuple(children)
+        _set(self, 'type', type)  # 'operator' or 'operand'
+        _set(self, 'value', value)  # For 'operator' nodes: 'AND' or 'OR'
+        _set(self, 'children', children)  # For 'operator' nodes
+        _set(self, 'attribute', attribute)  # For 'operand' nodes
+        _set(self, 'operator', operator)    # For 'operand' nodes
+        _set(self, 'constant', constant)    # For 'operand' nodes
+        if type == 'operand':
+            _set(self, '_hash', hash((type, attribute, operator, constant)))
+        else:
+            _set(self, '_hash', hash((type, value, children)))
+
+    @property
+    def left(self):
+        return self.children[0] if self.children else None
+
+    @property
+    def right(self):
+        if not self.children or len(self.children) < 2:
+            return None
+        if len(self.children) == 2:
+            return self.children[1]
+        return Node(self.type, self.value, children=self.children[1:])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Node is immutable, cannot set '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Node is immutable, cannot delete '{name}'")
+
+    def __reduce__(self):
+        return (make_node, (self.type, self.value, self.attribute, self.operator, self.constant, self.children))
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Node):
             return False
-        if self.type != other.type:
+        if self._hash != other._hash or self.type != other.type:
             return False
         if self.type == 'operator':
             return (
                 self.value == other.value and
-                self.left == other.left and
-                self.right == other.right
+                self.children == other.children
             )
         elif self.type == 'operand':
             return (
@@ -32,12 +78,71 @@ class Node:
             return False
 
     def __hash__(self):
-        return hash((self.type, self.value, self.attribute, self.operator, self.constant))
+        return self._hash
 
     def __repr__(self):
         if self.type == 'operator':
-            return f"Node(type={self.type}, value={self.value}, left={self.left}, right={self.right})"
+            return f"Node(type={self.type}, value={self.value}, children={list(self.children or ())})"
         elif self.type == 'operand':
             return f"Node(type={self.type}, attribute={self.attribute}, operator={self.operator}, constant={self.constant})"
         else:
-            return f"Node(type={self.type})"
\ No newline at end of file
+            return f"Node(type={self.type})"
+
+# Canonical instance of every live node, keyed by structure. Entries disappear with the last rule using them.
+_interned = weakref.WeakValueDictionary()
+_interned_lock = threading.Lock()
+
+def _intern_key(type, value, attribute, operator, constant, children) -> tuple:
+    if type == 'operand':
+        # The constant's type is part of the key so that 1 and '1' stay distinct nodes
+        return (type, attribute, operator, constant, constant.__class__)
+    # Children are shared nodes, so comparing the key's children is an identity check
+    return (type, value, children)
+
+def make_node(type, value=None, attribute=None, operator=None, constant=None, children=None) -> Node:
+    """
+    Return the shared node with the given structure, creating it on first use, so identical
+    operands and subtrees exist once across every loaded rule. Children should be shared
+    nodes themselves; build whole trees bottom-up or use intern_node.
+    """
+    if children is not None:
+        children = tuple(children)
+    key = _intern_key(type, value, attribute, operator, constant, children)
+    with _interned_lock:
+        node = _interned.get(key)
+        if node is None:
+            node = Node(type, value, attribute=attribute, operator=operator, constant=constant, children=children)
+            _interned[key] = node
+    return node
+
+def fold_tree(root, children_of: Callable[[Any], Optional[Iterable]], build: Callable[[Any, Optional[list]], Any]):
+    """
+    Post-order traversal with an explicit stack, so deep trees do not hit the recursion limit.
+    build(node, results) is called with the results for node's children in order, or with None
+    when children_of(node) is None, and the result for root is returned.
+    """
+    results = []
+    stack = [(root, results, None)]
+    while stack:
+        node, out, child_results = stack.pop()
+        if child_results is None:
+            children = children_of(node)
+            if children is not None:
+                child_results = []
+                stack.append((node, out, child_results))
+                stack.extend((child, child_results, None) for child in reversed(children))
+                continue
+        out.append(build(node, child_results))
+    return results[0]
+
+def intern_node(node: Node) -> Node:
+    """Return the shared copy of a tree built with plain Node constructors"""
+    if node is None:
+        return None
+    return fold_tree(node, lambda node: node.children, lambda node, children: make_node(
+        node.type, node.value, node.attribute, node.operator, node.constant, children))
+
+def interned_node_count() -> int:
+    """Number of distinct live nodes in the intern table"""
+    with _interned_lock:
+        return len(_interned)
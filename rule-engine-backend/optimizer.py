@@ -0,0 +1,194 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from evaluator import evaluate_condition
+from node import Node, fold_tree
+from utils import ast_to_rule_string
+
+DEFAULT_PASS_RATE = 0.5
+DEFAULT_COST = 1.0
+# Decisions spell out children with at most this many conditions and summarize larger ones
+DESCRIBED_CONDITIONS = 20
+
+def operand_key(node: Node) -> tuple:
+    """Key identifying a condition across rules, as used by combine_asts"""
+    return (node.attribute, node.operator, node.constant)
+
+def order_ast(ast: Node, pass_rates: Optional[Dict[tuple, float]] = None,
+              costs: Optional[Dict[tuple, float]] = None, decisions: Optional[List[dict]] = None,
+              failure_rates: Optional[Dict[tuple, float]] = None) -> Node:
+    """
+    Reorder the children of AND/OR nodes so that the branch most likely to decide the result
+    cheaply is evaluated first by the short-circuiting evaluator.
+
+    pass_rates maps an operand key to the observed probability that the condition is true,
+    costs maps it to its relative evaluation cost and failure_rates to the probability that
+    it raises. Unknown operands default to a pass rate of 0.5, a cost of 1 and no failures.
+    A condition that raises does not decide its parent: the caller has to evaluate the rule
+    in its original order instead, so conditions that often raise are moved back. Returns a
+    new tree; the input AST is not modified. If a decisions list is given, one entry per
+    AND/OR node is appended explaining the order that was chosen.
+    """
+    pass_rates, costs, failure_rates = pass_rates or {}, costs or {}, failure_rates or {}
+    ordered, _, _, _, _ = fold_tree(
+        ast,
+        lambda node: node.children if node.type == 'operator' else None,
+        lambda node, children: _order(node, children, pass_rates, costs, failure_rates, decisions)
+    )
+    return ordered
+
+def _order(node: Node, children, pass_rates, costs, failure_rates,
+           decisions=None) -> Tuple[Node, float, float, float, int]:
+    """
+    Return the reordered subtree, its probability of being true, its expected cost, its
+    failure rate and its number of conditions, given the same for each of its children
+    """
+    if node.type == 'operand':
+        key = operand_key(node)
+        return (node, pass_rates.get(key, DEFAULT_PASS_RATE), costs.get(key, DEFAULT_COST),
+                failure_rates.get(key, 0.0), 1)
+    if node.value not in ('AND', 'OR'):
+        raise ValueError(f'Unknown operator {node.value}')
+
+    # A later child only runs while the earlier ones are all true (AND) or all false (OR), so
+    # the expected cost is minimised by sorting on cost over the chance of deciding the result
+    is_and = node.value == 'AND'
+    ordered = sorted(children, key=lambda child: _rank(child[1] if is_and else 1 - child[1], child[2], child[3]))
+    rate, cost, failure_rate = _chain(ordered, is_and)
+
+    if decisions is not None:
+        decisions.append({
+            'operator': node.value,
+            'order': [_describe(child[0], child[4]) for child in ordered],
+            'reordered': [child[0] for child in ordered] != [child[0] for child in children],
+            'expected_cost': cost,
+            'original_order_cost': _chain(children, is_and)[1],
+            'pass_rate': rate,
+            'failure_rate': failure_rate
+        })
+    conditions = sum(child[4] for child in children)
+    return (Node(type='operator', value=node.value, children=[child[0] for child in ordered]), rate, cost,
+            failure_rate, conditions)
+
+def _describe(node: Node, conditions: int) -> str:
+    # Spelling out every child of a deep chain would take time quadratic in its depth
+    if conditions <= DESCRIBED_CONDITIONS:
+        return ast_to_rule_string(node)
+    return f'({node.value} of {conditions} conditions)'
+
+def _rank(continue_rate: float, cost: float, failure_rate: float = 0.0) -> float:
+    """Cost of a child divided by its chance of ending the chain without raising"""
+    decide_rate = (1 - failure_rate) * (1 - continue_rate)
+    if decide_rate <= 0:
+        return float('inf')
+    return cost / decide_rate
+
+def _chain(children, is_and: bool) -> Tuple[float, float, float]:
+    """
+    Probability of being true (among evaluations that do not raise), expected cost and
+    failure rate of evaluating children in the given order
+    """
+    reach = 1.0
+    cost = 0.0
+    failure_rate = 0.0
+    for _, rate, child_cost, child_failure_rate, _ in children:
+        cost += reach * child_cost
+        failure_rate += reach * child_failure_rate
+        reach *= (1 - child_failure_rate) * (rate if is_and else 1 - rate)
+    if failure_rate >= 1:
+        return DEFAULT_PASS_RATE, cost, 1.0
+    # reach is the chance of getting through every child without raising or deciding early
+    continued = reach / (1 - failure_rate)
+    return (continued if is_and else 1 - continued), cost, failure_rate
+
+class OperandStatistics:
+    """
+    Runtime statistics per condition, shared by every rule that uses it: how often it was
+    evaluated, passed or raised, and how long it took.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}   # operand key -> [evaluations, passes, failures, seconds]
+
+    def record(self, key: tuple, passed: bool, failed: bool, seconds: float):
+        with self._lock:
+            counts = self._counts.setdefault(key, [0, 0, 0, 0.0])
+            counts[0] += 1
+            counts[1] += passed
+            counts[2] += failed
+            counts[3] += seconds
+
+    def pass_rates(self) -> Dict[tuple, float]:
+        """Probability of each condition being true, among the evaluations that did not raise"""
+        with self._lock:
+            return {
+                key: passes / (evaluations - failures)
+                for key, (evaluations, passes, failures, _) in self._counts.items()
+                if evaluations > failures
+            }
+
+    def failure_rates(self) -> Dict[tuple, float]:
+        """Probability of each condition raising, for instance on a missing attribute"""
+        with self._lock:
+            return {
+                key: failures / evaluations
+                for key, (evaluations, _, failures, _) in self._counts.items()
+                if evaluations
+            }
+
+    def costs(self) -> Dict[tuple, float]:
+        """Mean evaluation time of each condition relative to the mean over all conditions"""
+        with self._lock:
+            means = {key: seconds / evaluations for key, (evaluations, _, _, seconds) in self._counts.items()}
+        overall = sum(means.values()) / len(means) if means else 0.0
+        if not overall:
+            return {}
+        return {key: mean / overall for key, mean in means.items()}
+
+    def describe(self, key: tuple) -> dict:
+        with self._lock:
+            evaluations, passes, failures, seconds = self._counts.get(key, (0, 0, 0, 0.0))
+        return {
+            'evaluations': evaluations,
+            'pass_rate': passes / (evaluations - failures) if evaluations > failures else None,
+            'failure_rate': failures / evaluations if evaluations else None,
+            'mean_cost_us': seconds / evaluations * 1e6 if evaluations else None
+        }
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+def record_statistics(ast: Node, data: dict, statistics: OperandStatistics):
+    """
+    Evaluate every condition of a rule against data and record the outcome. Unlike evaluate_ast
+    nothing is short-circuited, so later branches are sampled as often as earlier ones.
+    """
+    seen = set()
+    for node in collect_operands(ast):
+        key = operand_key(node)
+        if key in seen:
+            continue
+        seen.add(key)
+        start = time.perf_counter()
+        try:
+            passed = evaluate_condition(node, data)
+            failed = False
+        except Exception:
+            passed = False
+            failed = True
+        statistics.record(key, passed, failed, time.perf_counter() - start)
+
+def collect_operands(ast: Node) -> List[Node]:
+    """Return the operand nodes of a rule from left to right"""
+    operands = []
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if node.type == 'operand':
+            operands.append(node)
+        else:
+            stack.extend(reversed(node.children))
+    return operands
@@ -1,45 +1,320 @@
-from pyparsing import (
-    infixNotation, opAssoc, Word, alphas, alphanums, nums, Keyword, ParserElement, quotedString, removeQuotes
-)
-from node import Node
-
-ParserElement.enablePackrat()
-
-AND = Keyword("AND", caseless=True)
-OR = Keyword("OR", caseless=True)
-comparison_op = Word("<>=!", max=2)
-identifier = Word(alphas, alphanums + "_")
-integer = Word(nums)
-string_literal = quotedString.setParseAction(removeQuotes)
-value = integer | string_literal
-
-def condition_parse_action(tokens):
-    """Convert a parsed condition into a Node object"""
-    node = Node(
-        type='operand',
-        attribute=tokens.attribute,
-        operator=tokens.operator,
-        constant=tokens.value
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from flat import FlatRule
+from node import Node, make_node
+from tracing import DEBUG, tracer
+
+PARSERS = ('pratt', 'pyparsing')
+
+# Binding power of the logical operators: AND binds tighter than OR
+PRECEDENCE = {'OR': 1, 'AND': 2}
+
+# Each match skips leading whitespace and captures one token
+TOKEN_PATTERN = re.compile(r"""
+    [ \t\r\n]*
+    (?:
+    (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<operator>[<>=!]{1,2})
+  | (?P<integer>[0-9]+)
+  | (?P<name>[A-Za-z][A-Za-z0-9_]*)
+  | (?P<string>"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"
+              |'(?:[^'\n\r\\]|''|\\(?:[^x]|x[0-9a-fA-F]+))*')
+  | (?P<error>[^ \t\r\n])
     )
-    print(f"Created operand node: {node}")
-    return node
-
-condition = (
-    identifier("attribute") +
-    comparison_op("operator") +
-    value("value")
-).setParseAction(condition_parse_action)
-
-# Define the grammar
-bool_expr = infixNotation(
-    condition,
-    [
-        (AND, 2, opAssoc.LEFT, lambda t: Node('operator', 'AND', left=t[0][0], right=t[0][2])),
-        (OR, 2, opAssoc.LEFT, lambda t: Node('operator', 'OR', left=t[0][0], right=t[0][2]))
-    ]
-)
-
-def parse_rule(rule_string):
-    """Parse a rule-string into an Abstract Syntax Tree"""
-    result = bool_expr.parseString(rule_string, parseAll=True)
-    return result[0]
+""", re.VERBOSE)
+
+class RuleSyntaxError(ValueError):
+    """Raised when a rule string cannot be parsed. position is the 0-based offset of the error."""
+    def __init__(self, message, rule_string, position):
+        line = rule_string.count('\n', 0, position) + 1
+        column = position - (rule_string.rfind('\n', 0, position) + 1) + 1
+        super().__init__(f"{message} (at char {position}), (line:{line}, col:{column})")
+        self.message = message
+        self.position = position
+        self.line = line
+        self.column = column
+
+def tokenize(rule_string: str) -> List[Tuple[str, str, int]]:
+    """Split a rule string into (kind, text, position) tokens, ending with an 'end' token"""
+    tokens = []
+    append = tokens.append
+    previous_end = -1
+    previous_kind = None
+    for match in TOKEN_PATTERN.finditer(rule_string):
+        kind = match.lastgroup
+        text = match.group(kind)
+        position = match.start(kind)
+        if kind == 'error':
+            raise RuleSyntaxError(f"Unexpected character {text!r}", rule_string, position)
+        # AND/OR are keywords unless glued to a preceding number, as in '30AND'
+        if kind == 'name' and text.upper() in PRECEDENCE and not (
+                previous_kind == 'integer' and previous_end == position):
+            kind = 'keyword'
+        append((kind, text, position))
+        previous_kind = kind
+        previous_end = match.end()
+    append(('end', '', len(rule_string)))
+    return tokens
+
+class RuleParser:
+    """
+    Precedence-climbing parser that turns a rule string into an Abstract Syntax Tree.
+    Chains of the same operator, parenthesised or not, are flattened into one n-ary node.
+    """
+    def __init__(self, rule_string: str):
+        # pyparsing expands tabs before parsing, which also reaches into quoted constants
+        rule_string = rule_string.expandtabs()
+        self.rule_string = rule_string
+        self.tokens = tokenize(rule_string)
+        self.index = 0
+
+    def parse(self) -> Node:
+        node = self.parse_expression(1)
+        kind, _, _ = self.tokens[self.index]
+        if kind != 'end':
+            raise self.error("Expected AND, OR or end of rule")
+        return node
+
+    def parse_expression(self, min_precedence: int) -> Node:
+        left = self.parse_primary()
+        tokens = self.tokens
+        # Children of the chain being built; nodes are immutable, so the node is made once it ends
+        chain_operator = None
+        children = None
+        while True:
+            kind, text, _ = tokens[self.index]
+            if kind != 'keyword':
+                break
+            operator = text.upper()
+            precedence = PRECEDENCE[operator]
+            if precedence < min_precedence:
+                break
+            self.index += 1
+            right = self.parse_expression(precedence + 1)
+            if operator != chain_operator:
+                if children is not None:
+                    left = make_node('operator', chain_operator, children=children)
+                chain_operator = operator
+                if left.type == 'operator' and left.value == operator:
+                    children = list(left.children)
+                else:
+                    children = [left]
+            if right.type == 'operator' and right.value == operator:
+                children.extend(right.children)
+            else:
+                children.append(right)
+        if children is not None:
+            left = make_node('operator', chain_operator, children=children)
+        return left
+
+    def parse_primary(self) -> Node:
+        kind, _, _ = self.tokens[self.index]
+        if kind == 'lparen':
+            self.index += 1
+            node = self.parse_expression(1)
+            if self.tokens[self.index][0] != 'rparen':
+                raise self.error("Expected ')'")
+            self.index += 1
+            return node
+        # A keyword in operand position is an attribute name, as in the pyparsing grammar
+        if kind in ('name', 'keyword'):
+            return self.parse_condition()
+        raise self.error("Expected a condition or '('")
+
+    def parse_condition(self) -> Node:
+        tokens = self.tokens
+        attribute = tokens[self.index][1]
+        self.index += 1
+        kind, operator, _ = tokens[self.index]
+        if kind != 'operator':
+            raise self.error("Expected a comparison operator")
+        self.index += 1
+        kind, text, _ = tokens[self.index]
+        if kind == 'integer':
+            constant = text
+        elif kind == 'string':
+            constant = text[1:-1]
+        else:
+            raise self.error("Expected an integer or quoted string")
+        self.index += 1
+        node = make_node('operand', attribute=attribute, operator=operator, constant=constant)
+        if tracer.level <= DEBUG:
+            tracer.emit('parse.operand', DEBUG, node=node)
+        return node
+
+    def error(self, message: str) -> RuleSyntaxError:
+        kind, text, position = self.tokens[self.index]
+        found = 'end of rule' if kind == 'end' else repr(text)
+        return RuleSyntaxError(f"{message}, found {found}", self.rule_string, position)
+
+class ParseCache:
+    """
+    Bounded, thread-safe LRU cache of parsed rules keyed by the rule string with tabs expanded
+    and surrounding whitespace removed. Syntax errors are cached too, so re-validating the same invalid text
+    is as cheap as re-validating valid text.
+
+    Nodes are immutable, so cached ASTs are safely shared between callers.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Read the cache size from the app config"""
+        self.max_size = int(app.config.get('PARSE_CACHE_SIZE', self.max_size))
+        self.clear()
+
+    def parse(self, rule_string: str) -> Node:
+        expanded = rule_string.expandtabs()
+        key = expanded.strip()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            try:
+                entry = RuleParser(key).parse()
+            except RuleSyntaxError as e:
+                entry = e
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        if isinstance(entry, RuleSyntaxError):
+            # Report the position within the caller's string, not the stripped key
+            offset = len(expanded) - len(expanded.lstrip())
+            raise RuleSyntaxError(entry.message, expanded, entry.position + offset)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+parse_cache = ParseCache()
+
+def parse_rule(rule_string, parser='pratt', cache=True):
+    """
+    Parse a rule-string into an Abstract Syntax Tree.
+    Results of the default parser come from the shared parse cache unless cache is False,
+    which bulk parsing uses so that one-off rules do not evict frequently parsed ones.
+    parser='pyparsing' uses the original pyparsing grammar instead, without caching.
+    """
+    if parser == 'pyparsing':
+        from pyparsing_parser import parse_rule as parse_rule_pyparsing
+        return parse_rule_pyparsing(rule_string)
+    if parser != 'pratt':
+        raise ValueError(f"Unknown parser '{parser}', expected one of {', '.join(PARSERS)}")
+    if not isinstance(rule_string, str):
+        raise TypeError(f"Rule string must be a string, got {type(rule_string).__name__}")
+    if not cache:
+        return RuleParser(rule_string).parse()
+    return parse_cache.parse(rule_string)
+
+# Rule strings sent to a worker process at a time by parse_rules_parallel
+PARALLEL_CHUNK_SIZE = 500
+
+# Worker pools shared by every parse_rules_parallel call, keyed by their number of workers
+_executors = {}
+_executors_lock = threading.Lock()
+
+def serialize_ast(rule_string: str, ast: Node) -> bytes:
+    """Default result of parse_rules_parallel: the compact FlatRule encoding of the AST"""
+    return FlatRule.from_ast(ast).to_bytes()
+
+def discard_ast(rule_string: str, ast: Node) -> None:
+    """Result of parse_rules_parallel when only whether each rule parses matters"""
+    return None
+
+def parse_rules_parallel(rule_strings: Iterable[str], workers: Optional[int] = None,
+                         chunk_size: int = PARALLEL_CHUNK_SIZE,
+                         prepare: Callable[[str, Node], Any] = serialize_ast) -> Iterator[Tuple[Any, Optional[str]]]:
+    """
+    Parse rule strings with parse_rule in a pool of worker processes, one process per CPU by default.
+
+    Yields (prepare(rule_string, ast), None) for each rule string in input order, or (None, error
+    message) when it does not parse. The ASTs stay in the workers: only what prepare returns, by
+    default FlatRule bytes, is sent back, so prepare must be a module-level function. Input is
+    read lazily with a bounded number of chunks in flight, and a single chunk is parsed in this
+    process without starting a pool. The pool is started once and reused by later calls.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    rule_strings = iter(rule_strings)
+    chunk = list(islice(rule_strings, chunk_size))
+    next_chunk = list(islice(rule_strings, chunk_size))
+    if workers <= 1 or not next_chunk:
+        while chunk:
+            yield from _parse_chunk(chunk, prepare)
+            chunk, next_chunk = next_chunk, list(islice(rule_strings, chunk_size))
+        return
+    executor = _parse_executor(workers)
+    pending = []
+    try:
+        while chunk:
+            pending.append(executor.submit(_parse_chunk, chunk, prepare))
+            if len(pending) > workers:
+                yield from pending.pop(0).result()
+            chunk, next_chunk = next_chunk, list(islice(rule_strings, chunk_size))
+        while pending:
+            yield from pending.pop(0).result()
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool on the next call
+        with _executors_lock:
+            if _executors.get(workers) is executor:
+                del _executors[workers]
+        raise
+    finally:
+        # The caller stopped early or failed: drop the chunks it will not read
+        for future in pending:
+            future.cancel()
+
+def _parse_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    The shared pool with the given number of workers. Workers are started from a fork server
+    (or spawned where there is none) rather than forked from this multi-threaded process.
+    """
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            _executors[workers] = executor
+        return executor
+
+def _parse_chunk(rule_strings: List[str], prepare: Callable[[str, Node], Any]) -> List[Tuple[Any, Optional[str]]]:
+    # Runs in the worker processes. Bypasses the parse cache, which one-off rules would only churn.
+    results = []
+    for rule_string in rule_strings:
+        try:
+            results.append((prepare(rule_string, parse_rule(rule_string, cache=False)), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
@@ -1,26 +1,135 @@
 from flask import Blueprint, request, jsonify
 from models import Rule
-from evaluator import evaluate_ast
-from utils import dict_to_ast
-import json
+from evaluator import evaluate_batch, results_to_bitmap
+from compiler import ENGINES
+from cache import PreparedRule
+from extensions import rule_cache, rule_network, operand_statistics
+from optimizer import collect_operands, operand_key
+from utils import ast_to_dict, ast_to_rule_string
+from parser import parse_cache
+from node import interned_node_count
+from functools import partial
+import base64
 
 # Define the blueprint here
 evaluation_bp = Blueprint('evaluation_bp', __name__)
 
+def load_prepared_rule(rule_id):
+    """Fetch a rule from the database and rebuild its AST for the rule cache"""
+    rule = Rule.query.get(rule_id)
+    if not rule:
+        return None
+    return PreparedRule(rule.id, rule.load_flat(), operand_statistics)
+
+def ensure_rule_network():
+    """Build the rule matching network from every stored rule on first use"""
+    if not rule_network.loaded:
+        rule_network.load(_stored_asts())
+
+def _stored_asts():
+    # A row that cannot be decoded is left out rather than stop the network from loading
+    for rule in Rule.query.all():
+        try:
+            ast = rule.load_ast()
+        except Exception as e:
+            print(f"Skipping rule {rule.id} in rule network: {e}")
+            continue
+        yield rule.id, ast
+
 @evaluation_bp.route('/evaluate_rule', methods=['POST'])
 def evaluate_rule():
     """Evaluates a rule against given input data and returns the result"""
     data = request.get_json()
     rule_id = data.get('rule_id')
     input_data = data.get('data')
+    engine = data.get('engine', 'interpreted')
+    if engine not in ENGINES:
+        return jsonify({'error': f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}"}), 400
     try:
-        rule = Rule.query.get(rule_id)
-        if not rule:
+        prepared = rule_cache.get_or_load(int(rule_id), load_prepared_rule)
+        if not prepared:
             return jsonify({'error': 'Rule not found'}), 404
-        ast_dict = json.loads(rule.ast_json)
-        ast = dict_to_ast(ast_dict)
-        result = evaluate_ast(ast, input_data)
+        result = prepared.evaluate(input_data, engine)
         return jsonify({'result': result})
     except Exception as e:
         print(f"Error evaluating rule: {e}")
         return jsonify({'error': str(e)}), 400
+
+@evaluation_bp.route('/evaluate_rule/batch', methods=['POST'])
+def evaluate_rule_batch():
+    """Evaluates a rule against a list of input records, loading and preparing the rule once"""
+    data = request.get_json()
+    rule_id = data.get('rule_id')
+    records = data.get('records')
+    engine = data.get('engine', 'interpreted')
+    result_format = data.get('format', 'list')
+    if not isinstance(records, list):
+        return jsonify({'error': "'records' must be a list of input data objects"}), 400
+    if engine not in ENGINES:
+        return jsonify({'error': f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}"}), 400
+    if result_format not in ('list', 'bitmap'):
+        return jsonify({'error': f"Unknown format '{result_format}', expected list or bitmap"}), 400
+    try:
+        prepared = rule_cache.get_or_load(int(rule_id), load_prepared_rule)
+        if not prepared:
+            return jsonify({'error': 'Rule not found'}), 404
+        results, errors = evaluate_batch(partial(prepared.evaluate, engine=engine), records)
+        response = {'count': len(results), 'errors': errors}
+        if result_format == 'bitmap':
+            response['bitmap'] = base64.b64encode(results_to_bitmap(results)).decode('ascii')
+        else:
+            response['results'] = results
+        return jsonify(response)
+    except Exception as e:
+        print(f"Error evaluating rule batch: {e}")
+        return jsonify({'error': str(e)}), 400
+
+@evaluation_bp.route('/match', methods=['POST'])
+def match_rules():
+    """Matches one input record against every stored rule and returns the ids of the rules that fire"""
+    data = request.get_json()
+    input_data = data.get('data')
+    if not isinstance(input_data, dict):
+        return jsonify({'error': "'data' must be an input data object"}), 400
+    try:
+        ensure_rule_network()
+        matched, unevaluated = rule_network.match(input_data)
+        return jsonify({'matched': matched, 'unevaluated': unevaluated})
+    except Exception as e:
+        print(f"Error matching rules: {e}")
+        return jsonify({'error': str(e)}), 400
+
+@evaluation_bp.route('/rules/<int:rule_id>/explain', methods=['GET'])
+def explain_rule(rule_id):
+    """Shows the evaluation order chosen for a rule and the runtime statistics behind it"""
+    try:
+        prepared = rule_cache.get_or_load(rule_id, load_prepared_rule)
+        if not prepared:
+            return jsonify({'error': 'Rule not found'}), 404
+        operands = []
+        for key in dict.fromkeys(operand_key(node) for node in collect_operands(prepared.ast)):
+            attribute, operator_str, constant = key
+            operands.append({'attribute': attribute, 'operator': operator_str, 'constant': constant,
+                             **operand_statistics.describe(key)})
+        return jsonify({
+            'rule_id': rule_id,
+            'evaluations': prepared.evaluations,
+            'rule_string': ast_to_rule_string(prepared.ast),
+            'plan': ast_to_rule_string(prepared.plan),
+            'plan_ast': ast_to_dict(prepared.plan),
+            'operands': operands,
+            'decisions': prepared.decisions
+        })
+    except Exception as e:
+        print(f"Error explaining rule: {e}")
+        return jsonify({'error': str(e)}), 400
+
+@evaluation_bp.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Report hit/miss counters of the in-memory rule and parse caches and the number of shared AST nodes"""
+    return jsonify({
+        'rule_cache': rule_cache.stats(),
+        'parse_cache': parse_cache.stats(),
+        'rule_network': rule_network.stats(),
+        'interned_nodes': interned_node_count()
+    })
@@ -1,13 +1,62 @@
-from flask import Blueprint, request, jsonify
-from models import Rule
-from parser import parse_rule
-from utils import ast_to_dict, dict_to_ast, simplify_ast, ast_to_rule_string, combine_asts
-from extensions import db
-import json
+from flask import Blueprint, current_app, request, jsonify
+from models import Rule, RuleAttribute
+from parser import discard_ast, parse_rule, parse_rules_parallel
+from utils import ast_to_rule_string, combine_asts
+from extensions import db, rule_cache, rule_network
+from bulk import BULK_FORMATS, DEFAULT_CHUNK_SIZE, import_rules, read_rule_strings
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, selectinload
+
+# Fields the /rules listing can return, and its page sizes
+RULE_FIELDS = ('id', 'rule_string', 'ast', 'is_combined', 'attributes', 'operand_count', 'depth', 'structural_hash',
+               'canonical_hash')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Columns each field is read from; 'attributes' is loaded from the rule_attribute table
+FIELD_COLUMNS = {
+    'id': Rule.id,
+    'rule_string': Rule.rule_string,
+    'ast': Rule.ast_json,
+    'is_combined': Rule.is_combined,
+    'operand_count': Rule.operand_count,
+    'depth': Rule.depth,
+    'structural_hash': Rule.structural_hash,
+    'canonical_hash': Rule.canonical_hash
+}
 
 # Define the blueprint here
 rule_bp = Blueprint('rule_bp', __name__)
 
+def rule_to_dict(rule, fields=RULE_FIELDS) -> dict:
+    """The requested fields of a rule, as returned by /rules and /rules/<id>"""
+    rule_data = {}
+    for field in fields:
+        if field == 'ast':
+            rule_data['ast'] = rule.ast_dict()
+        else:
+            rule_data[field] = getattr(rule, field)
+    return rule_data
+
+def save_rule(rule, ast):
+    """
+    Store a rule built with Rule.from_ast unless an equivalent rule, one with the same canonical
+    hash, is stored already. Returns the stored rule and whether it was created.
+    """
+    existing = Rule.query.filter_by(canonical_hash=rule.canonical_hash).first()
+    if existing:
+        return existing, False
+    db.session.add(rule)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # An equivalent rule was stored by another request in the meantime
+        db.session.rollback()
+        return Rule.query.filter_by(canonical_hash=rule.canonical_hash).one(), False
+    rule_cache.invalidate(rule.id)
+    rule_network.add_rule(rule.id, ast)
+    return rule, True
+
 @rule_bp.route('/create_rule', methods=['POST'])
 def create_rule_endpoint():
     """Create a new rule based on a given rule string."""
@@ -15,10 +64,9 @@ def create_rule_endpoint():
     rule_string = data.get('rule_string')
     try:
         ast = parse_rule(rule_string)
-        ast_json = json.dumps(ast_to_dict(ast))
-        new_rule = Rule(rule_string=rule_string, ast_json=ast_json)
-        db.session.add(new_rule)
-        db.session.commit()
+        new_rule, created = save_rule(Rule.from_ast(rule_string, ast), ast)
+        if not created:
+            return jsonify({'message': 'Rule already exists', 'rule_id': new_rule.id}), 200
         return jsonify({'message': 'Rule created', 'rule_id': new_rule.id}), 201
     except Exception as e:
         print(f"Error creating rule: {e}")
@@ -26,19 +74,48 @@ def create_rule_endpoint():
 
 @rule_bp.route('/rules', methods=['GET'])
 def get_rules():
-    """Fetch all rules."""
+    """
+    Fetch one page of rules, ordered by id.
+
+    Query parameters:
+      after_id  - return rules with an id greater than this (the previous page's next_after_id)
+      limit     - page size, at most MAX_PAGE_SIZE
+      fields    - comma-separated subset of RULE_FIELDS; ast_json is only loaded when 'ast' is requested
+      attribute - only rules with a condition on this attribute
+      combined  - 'true' or 'false' to only return combined or non-combined rules
+    """
     try:
-        rules = Rule.query.all()
-        rules_list = [
-            {
-                'id': rule.id,
-                'rule_string': rule.rule_string,
-                'ast': json.loads(rule.ast_json),
-                'is_combined': 'Combined Rule' in rule.rule_string
-            }
-            for rule in rules
-        ]
-        return jsonify({'rules': rules_list})
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': f"'limit' must be between 1 and {MAX_PAGE_SIZE}"}), 400
+        fields = request.args.get('fields')
+        fields = RULE_FIELDS if fields is None else tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = [field for field in fields if field not in RULE_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown fields {', '.join(unknown)}, expected some of {', '.join(RULE_FIELDS)}"}), 400
+        combined = request.args.get('combined')
+        if combined not in (None, 'true', 'false'):
+            return jsonify({'error': "'combined' must be true or false"}), 400
+
+        columns = [FIELD_COLUMNS[field] for field in fields if field in FIELD_COLUMNS]
+        query = Rule.query.options(load_only(Rule.id, *columns))
+        if 'attributes' in fields:
+            query = query.options(selectinload(Rule.attribute_entries))
+        query = query.filter(Rule.id > after_id)
+        attribute = request.args.get('attribute')
+        if attribute:
+            query = query.filter(Rule.id.in_(
+                RuleAttribute.query.with_entities(RuleAttribute.rule_id).filter(RuleAttribute.attribute == attribute)
+            ))
+        if combined is not None:
+            query = query.filter(Rule.is_combined.is_(combined == 'true'))
+        # One extra row tells whether another page follows
+        rules = query.order_by(Rule.id).limit(limit + 1).all()
+        next_after_id = rules[limit - 1].id if len(rules) > limit else None
+
+        rules_list = [rule_to_dict(rule, fields) for rule in rules[:limit]]
+        return jsonify({'rules': rules_list, 'next_after_id': next_after_id})
     except Exception as e:
         print(f"Error fetching rules: {e}")
         return jsonify({'error': str(e)}), 400
@@ -50,12 +127,7 @@ def get_rule(rule_id):
         rule = Rule.query.get(rule_id)
         if not rule:
             return jsonify({'error': 'Rule not found'}), 404
-        rule_data = {
-            'id': rule.id,
-            'rule_string': rule.rule_string,
-            'ast': json.loads(rule.ast_json),
-        }
-        return jsonify({'rule': rule_data})
+        return jsonify({'rule': rule_to_dict(rule)})
     except Exception as e:
         print(f"Error fetching rule: {e}")
         return jsonify({'error': str(e)}), 400
@@ -72,7 +144,7 @@ def combine_rules_endpoint():
             return jsonify({'error': 'One or more rules not found'}), 404
 
         # Get the ASTs directly from the rules
-        asts = [dict_to_ast(json.loads(rule.ast_json)) for rule in rules]
+        asts = [rule.load_ast() for rule in rules]
 
         # Combine the ASTs using the optimized function
         combined_ast = combine_asts(asts)
@@ -81,12 +153,10 @@ def combine_rules_endpoint():
         combined_rule_string = ast_to_rule_string(combined_ast)
 
         # Save the new combined rule
-        combined_rule = Rule(
-            rule_string=combined_rule_string,
-            ast_json=json.dumps(ast_to_dict(combined_ast))
-        )
-        db.session.add(combined_rule)
-        db.session.commit()
+        combined_rule, created = save_rule(
+            Rule.from_ast(combined_rule_string, combined_ast, is_combined=True), combined_ast)
+        if not created:
+            return jsonify({'message': 'Equivalent rule already exists', 'rule_id': combined_rule.id}), 200
 
         return jsonify({'message': 'Rules combined', 'rule_id': combined_rule.id}), 201
 
@@ -94,6 +164,28 @@ def combine_rules_endpoint():
         print(f"Error combining rules: {e}")
         return jsonify({'error': str(e)}), 400
 
+@rule_bp.route('/rules/bulk', methods=['POST'])
+def bulk_import_rules():
+    """
+    Import many rules at once from the request body, given as NDJSON (one rule string or
+    {"rule_string": ...} object per line) or as CSV. The format is taken from the 'format'
+    query parameter or the Content-Type. Returns the counts and per-line errors; if the import
+    stops early, the summary of the chunks stored so far is returned with the error.
+    """
+    format = request.args.get('format')
+    if format is None:
+        format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if format not in BULK_FORMATS:
+        return jsonify({'error': f"Unknown format '{format}', expected one of {', '.join(BULK_FORMATS)}"}), 400
+    chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    if chunk_size < 1:
+        return jsonify({'error': "'chunk_size' must be positive"}), 400
+    summary = import_rules(read_rule_strings(request.stream, format), current_app.config['PARSE_WORKERS'],
+                           chunk_size)
+    if 'error' in summary:
+        return jsonify(summary), 400
+    return jsonify(summary), 201 if summary['created'] else 200
+
 @rule_bp.route('/validate_rule', methods=['POST'])
 def validate_rule():
     """Check if a given rule string is valid."""
@@ -104,3 +196,21 @@ def validate_rule():
         return jsonify({'valid': True})
     except Exception as e:
         return jsonify({'valid': False, 'error': str(e)}), 400
+
+@rule_bp.route('/validate_rules', methods=['POST'])
+def validate_rules():
+    """Check a list of rule strings at once, parsing them in a pool of worker processes."""
+    data = request.get_json()
+    rule_strings = data.get('rule_strings')
+    if not isinstance(rule_strings, list):
+        return jsonify({'error': "'rule_strings' must be a list of rule strings"}), 400
+    try:
+        results = [
+            {'valid': True} if error is None else {'valid': False, 'error': error}
+            for _, error in parse_rules_parallel(rule_strings, current_app.config['PARSE_WORKERS'],
+                                                 prepare=discard_ast)
+        ]
+        return jsonify({'results': results, 'valid': sum(result['valid'] for result in results)})
+    except Exception as e:
+        print(f"Error validating rules: {e}")
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,126 @@
+import random
+
+import pytest
+
+from cache import PreparedRule
+from compiler import compile_ast
+from evaluator import evaluate_ast
+from flat import FlatRule
+from matcher import RuleNetwork
+from optimizer import OperandStatistics
+from node import make_node
+from parser import parse_rule
+from utils import ast_metadata, ast_to_dict, ast_to_rule_string, canonical_hash, combine_asts, dict_to_ast, simplify_ast
+
+ATTRIBUTES = ('age', 'salary', 'department', 'score')
+OPERATORS = ('>', '<', '>=', '<=', '=', '!=')
+CONSTANTS = ('1', '5', '-3', '2.5', '1e3', "'5'", "'Sales'", "'b'", "''")
+VALUES = (0, 1, 5, -3, 2.5, 1000, float('nan'), float('inf'), '5', '1e3', 'Sales', 'b', '', None, True, 10 ** 400)
+
+def random_ast(rng: random.Random, depth: int = 4):
+    if depth == 0 or rng.random() < 0.3:
+        return make_node('operand', attribute=rng.choice(ATTRIBUTES), operator=rng.choice(OPERATORS),
+                         constant=rng.choice(CONSTANTS))
+    children = tuple(random_ast(rng, depth - 1) for _ in range(rng.randint(1, 3)))
+    return make_node('operator', value=rng.choice(('AND', 'OR')), children=children)
+
+def random_record(rng: random.Random) -> dict:
+    # Attributes are left out now and then so that conditions fail with a KeyError
+    return {attribute: rng.choice(VALUES) for attribute in ATTRIBUTES if rng.random() < 0.85}
+
+def outcome(evaluate, data):
+    """The result of evaluate(data), or the type of the exception it raised"""
+    try:
+        return evaluate(data)
+    except Exception as e:
+        return type(e)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_engines_agree_with_evaluate_ast(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        ast = random_ast(rng)
+        engines = {
+            'compiled': compile_ast(ast),
+            'flat': FlatRule.from_ast(ast).evaluate,
+            'from_bytes': FlatRule.from_bytes(FlatRule.from_ast(ast).to_bytes()).evaluate,
+        }
+        for _ in range(20):
+            data = random_record(rng)
+            expected = outcome(lambda record: evaluate_ast(ast, record), data)
+            for name, evaluate in engines.items():
+                assert outcome(evaluate, data) == expected, (name, ast, data)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rule_network_agrees_with_evaluate_ast(seed):
+    rng = random.Random(seed)
+    rules = {rule_id: random_ast(rng) for rule_id in range(300)}
+    network = RuleNetwork()
+    network.load(rules.items())
+    for step in range(300):
+        if step % 20 == 0:
+            # Rules change between matches, as when rules are created while records are matched
+            rule_id = rng.randrange(350)
+            if rng.random() < 0.5:
+                rules[rule_id] = random_ast(rng)
+                network.add_rule(rule_id, rules[rule_id])
+            else:
+                rules.pop(rule_id, None)
+                network.remove_rule(rule_id)
+        data = random_record(rng)
+        matched = []
+        unevaluated = 0
+        for rule_id, ast in rules.items():
+            result = outcome(lambda record: evaluate_ast(ast, record), data)
+            if isinstance(result, type):
+                unevaluated += 1
+            elif result:
+                matched.append(rule_id)
+        assert network.match(data) == (sorted(matched), unevaluated), data
+
+def test_rule_network_skips_rules_that_fail_to_compile():
+    network = RuleNetwork()
+    valid = make_node('operand', attribute='a', operator='>', constant='1')
+    unknown = make_node('operator', value='XOR', children=(valid,))
+    network.load([(1, unknown), (2, valid)])
+    assert network.match({'a': 2}) == ([2], 0)
+    assert network.stats()['conditions'] == 1
+
+def test_combine_10k_rules():
+    asts = [parse_rule(f"(age > {i % 60} AND department = 'd{i % 7}') OR salary < {i}") for i in range(10000)]
+    combined = combine_asts(asts)
+    data = {'age': 30, 'department': 'd3', 'salary': 5000}
+    expected = evaluate_ast(combined, data)
+    assert expected == any(evaluate_ast(ast, data) for ast in asts)
+    assert compile_ast(combined)(data) == expected
+    assert FlatRule.from_bytes(FlatRule.from_ast(combined).to_bytes()).evaluate(data) == expected
+    assert dict_to_ast(ast_to_dict(combined)) == combined
+    assert parse_rule(ast_to_rule_string(combined), cache=False) == combined
+    assert ast_metadata(combined)['attributes'] == ['age', 'department', 'salary']
+    assert canonical_hash(combine_asts(list(reversed(asts)))) == canonical_hash(combined)
+
+@pytest.mark.parametrize('depth', [150, 10000])
+def test_deep_rule_walks(depth):
+    # A chain nested depth levels deep, like combined rules stored before combine_asts built one n-ary node
+    ast = make_node('operand', attribute='a0', operator='>', constant='0')
+    for i in range(1, depth):
+        operand = make_node('operand', attribute=f'a{i % 50}', operator='>', constant=str(i % 7))
+        ast = make_node('operator', value='AND' if i % 2 else 'OR', children=(ast, operand))
+    data = {f'a{i}': i for i in range(50)}
+    expected = evaluate_ast(ast, data)
+    assert FlatRule.from_bytes(FlatRule.from_ast(ast).to_bytes()).evaluate(data) == expected
+    assert compile_ast(ast)(data) == expected
+    network = RuleNetwork()
+    network.load([(1, ast)])
+    assert network.match(data) == ([1] if expected else [], 0)
+    assert network.match({}) == ([], 1)
+    # Sampling statistics and reordering walk the whole rule as well
+    prepared = PreparedRule(1, ast, OperandStatistics())
+    prepared.evaluations = 999
+    for engine in ('interpreted', 'compiled'):
+        assert prepared.evaluate(data, engine) == expected
+    assert prepared.flat_plan is not prepared.rule
+    assert outcome(compile_ast(ast), {}) == outcome(lambda record: evaluate_ast(ast, record), {})
+    assert evaluate_ast(simplify_ast(ast), data) == expected
+    assert dict_to_ast(ast_to_dict(ast)) == ast
+    assert canonical_hash(ast) == canonical_hash(combine_asts([ast, ast]))
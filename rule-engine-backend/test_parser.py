@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from parser import RuleSyntaxError, parse_rule
+
+pyparsing = pytest.importorskip('pyparsing')
+
+ATTRIBUTES = ('age', 'department', 'x1', 'a_b', 'AND', 'Or')
+OPERATORS = ('>', '<', '=', '!=', '>=', '<=', '<>', '=!')
+CONSTANTS = ('30', '0', "'Sales'", '"x y"', "'it''s'", "''")
+SPACES = ('', ' ', '\t', '\n ')
+KEYWORDS = ('AND', 'OR', 'and', 'Or')
+GARBAGE = "ab1 ()'\"<>=!_ANDOR\n"
+
+def random_condition(rng: random.Random) -> str:
+    space = rng.choice(SPACES)
+    return f"{rng.choice(ATTRIBUTES)}{space}{rng.choice(OPERATORS)}{space}{rng.choice(CONSTANTS)}"
+
+def random_rule(rng: random.Random, depth: int = 4, parent: str = None) -> str:
+    """
+    A rule whose AND/OR chains have at most two operands, the only chains the pyparsing grammar
+    keeps whole. parse_rule flattens parenthesised chains as well, so an operator never has a
+    child with the same operator, and only an AND directly under an OR may go unparenthesised.
+    """
+    if depth == 0 or rng.random() < 0.3:
+        return random_condition(rng)
+    keyword = rng.choice([keyword for keyword in KEYWORDS if keyword.upper() != parent])
+    operator = keyword.upper()
+    rule = f"{random_rule(rng, depth - 1, operator)} {keyword} {random_rule(rng, depth - 1, operator)}"
+    if parent is None or (parent == 'OR' and operator == 'AND' and rng.random() < 0.7):
+        return rule
+    return f"({rule})"
+
+def outcome(rule_string: str, parser: str):
+    """The AST parsed from rule_string, or the exception raised"""
+    try:
+        return parse_rule(rule_string, parser=parser)
+    except (RuleSyntaxError, pyparsing.ParseException) as e:
+        return e
+
+@pytest.mark.parametrize('seed', range(5))
+def test_valid_rules_agree_with_pyparsing(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        rule_string = rng.choice((' ', '')) + random_rule(rng) + rng.choice(('', '\n'))
+        assert parse_rule(rule_string) == parse_rule(rule_string, parser='pyparsing'), rule_string
+
+@pytest.mark.parametrize('seed', range(5))
+def test_invalid_rules_agree_with_pyparsing(seed):
+    rng = random.Random(seed)
+    for _ in range(1000):
+        if rng.random() < 0.5:
+            rule_string = ''.join(rng.choice(GARBAGE) for _ in range(rng.randint(0, 12)))
+        else:
+            # A valid rule with one character removed, replaced or inserted
+            rule_string = random_rule(rng, 2).replace('\t', ' ')
+            position = rng.randrange(len(rule_string) + 1)
+            rule_string = rule_string[:position] + rng.choice(('', rng.choice(GARBAGE))) + \
+                rule_string[position + rng.randint(0, 1):]
+        ours = outcome(rule_string, 'pratt')
+        theirs = outcome(rule_string, 'pyparsing')
+        assert isinstance(ours, RuleSyntaxError) == isinstance(theirs, pyparsing.ParseException), rule_string
+        if not isinstance(ours, RuleSyntaxError):
+            assert ours == theirs, rule_string
+            continue
+        # pyparsing backtracks to the end of the longest rule it could parse, which never lies
+        # past the token we report, or past the end of the line of an unterminated string
+        if rule_string.startswith(("'", '"'), ours.position):
+            end = rule_string.find('\n', ours.position)
+            limit = len(rule_string) if end == -1 else end
+        else:
+            limit = ours.position + len(rule_string[ours.position:]) - len(rule_string[ours.position:].lstrip())
+        assert theirs.loc <= limit, (rule_string, ours, theirs)
+
+@pytest.mark.parametrize('rule_string, position, line, column, loc', [
+    ('', 0, 1, 1, 0),
+    ('a >', 3, 1, 4, 3),
+    ('(a > 1', 6, 1, 7, 6),
+    ('a > 1 b', 6, 1, 7, 6),
+    ('1 > a', 0, 1, 1, 0),
+    ('a >> 1 x', 7, 1, 8, 7),
+    # pyparsing backtracks to the end of the first condition
+    ("a > 1 AND\nb = 'x", 14, 2, 5, 6),
+    ('a > 1 AND', 9, 1, 10, 6),
+    ('a > 1 AND (b = 2 OR)', 19, 1, 20, 6),
+])
+def test_error_positions(rule_string, position, line, column, loc):
+    with pytest.raises(RuleSyntaxError) as ours:
+        parse_rule(rule_string)
+    with pytest.raises(pyparsing.ParseException) as theirs:
+        parse_rule(rule_string, parser='pyparsing')
+    assert (ours.value.position, ours.value.line, ours.value.column) == (position, line, column)
+    assert theirs.value.loc == loc
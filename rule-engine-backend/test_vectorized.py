@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from evaluator import evaluate_ast
+from node import make_node
+
+np = pytest.importorskip('numpy')
+from vectorized import evaluate_ast_columns
+
+ATTRIBUTES = ('age', 'salary', 'department')
+OPERATORS = ('>', '<', '>=', '<=', '=', '!=')
+CONSTANTS = ('1', '5', '-3', '2.5', "'5'", "'Sales'", "'b'", "''", "'5.0'")
+NUMBERS = (0, 1, 5, -3, 2.5, 1000, float('nan'), float('inf'))
+STRINGS = ('5', '5.0', ' 5 ', '1e3', 'Sales', 'b', '', 'nan')
+INVALID = (None, 10 ** 400, [1])
+
+def random_ast(rng: random.Random, depth: int = 3):
+    if depth == 0 or rng.random() < 0.3:
+        return make_node('operand', attribute=rng.choice(ATTRIBUTES), operator=rng.choice(OPERATORS),
+                         constant=rng.choice(CONSTANTS))
+    children = tuple(random_ast(rng, depth - 1) for _ in range(rng.randint(1, 3)))
+    return make_node('operator', value=rng.choice(('AND', 'OR')), children=children)
+
+def random_column(rng: random.Random, rows: int):
+    kind = rng.choice(('float', 'int', 'bool', 'str', 'mixed', 'invalid'))
+    if kind == 'float':
+        return np.array([rng.choice(NUMBERS) for _ in range(rows)], dtype=float)
+    if kind == 'int':
+        return np.array([rng.randint(-5, 5) for _ in range(rows)], dtype=np.int64)
+    if kind == 'bool':
+        return np.array([rng.random() < 0.5 for _ in range(rows)])
+    if kind == 'str':
+        return np.array([rng.choice(STRINGS) for _ in range(rows)])
+    values = NUMBERS + STRINGS
+    column = [rng.choice(values) for _ in range(rows)]
+    if kind == 'invalid':
+        # A few values that evaluate_condition rejects
+        for row in rng.sample(range(rows), 2):
+            column[row] = rng.choice(INVALID)
+    array = np.empty(rows, dtype=object)
+    array[:] = column
+    return array
+
+def outcome(evaluate, *args):
+    """The result of evaluate(*args), or the type of the exception it raised"""
+    try:
+        return evaluate(*args)
+    except Exception as e:
+        return type(e)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_columns_agree_with_evaluate_ast(seed):
+    rng = random.Random(seed)
+    rows = 40
+    for _ in range(300):
+        ast = random_ast(rng)
+        # An attribute is left out now and then, failing its conditions on every row
+        columns = {attribute: random_column(rng, rows) for attribute in ATTRIBUTES if rng.random() < 0.9}
+        expected = [outcome(evaluate_ast, ast, {attribute: column[row:row + 1].tolist()[0]
+                                                for attribute, column in columns.items()})
+                    for row in range(rows)]
+        failures = [result for result in expected if isinstance(result, type)]
+        result = outcome(evaluate_ast_columns, ast, columns)
+        if failures:
+            assert result == failures[0], (ast, columns)
+        else:
+            assert not isinstance(result, type), (ast, columns, result)
+            assert result.tolist() == expected, (ast, columns)
+
+def test_deep_rule():
+    ast = make_node('operand', attribute='a0', operator='>', constant='0')
+    for i in range(1, 5000):
+        operand = make_node('operand', attribute=f'a{i % 10}', operator='>', constant=str(i % 7))
+        ast = make_node('operator', value='AND' if i % 2 else 'OR', children=(ast, operand))
+    columns = {f'a{i}': np.arange(8) + i for i in range(10)}
+    expected = [evaluate_ast(ast, {attribute: int(column[row]) for attribute, column in columns.items()})
+                for row in range(8)]
+    assert evaluate_ast_columns(ast, columns).tolist() == expected
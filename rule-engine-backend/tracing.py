@@ -0,0 +1,61 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+# Trace levels, matching the standard logging levels
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+OFF = logging.CRITICAL + 10
+
+TRACE_LEVELS = {'debug': DEBUG, 'info': INFO, 'off': OFF}
+
+TraceHook = Callable[[str, int, dict], None]
+
+def log_trace_hook(event: str, level: int, fields: dict):
+    """Default hook: forward the event to the 'rule_engine.trace' logger, formatted only if it is emitted"""
+    logging.getLogger('rule_engine.trace').log(level, '%s %s', event, fields)
+
+class Tracer:
+    """
+    Off-by-default hook for parse and simplification events.
+
+    Call sites check `tracer.level <= level` before building an event, so while tracing is off
+    the only cost is that comparison. Events are passed to the hook as (event, level, fields)
+    with the fields left unformatted.
+    """
+    def __init__(self):
+        self.level = OFF
+        self.hook: Optional[TraceHook] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the trace level from the app config and log events through the default hook"""
+        level = str(app.config.get('TRACE_LEVEL', 'off')).lower()
+        if level not in TRACE_LEVELS:
+            raise ValueError(f"Unknown trace level '{level}', expected one of {', '.join(TRACE_LEVELS)}")
+        if TRACE_LEVELS[level] == OFF:
+            self.disable()
+            return
+        logger = logging.getLogger('rule_engine.trace')
+        logger.setLevel(TRACE_LEVELS[level])
+        if not logger.hasHandlers():
+            logger.addHandler(logging.StreamHandler())
+        self.enable(log_trace_hook, TRACE_LEVELS[level])
+
+    def enable(self, hook: TraceHook, level: int = DEBUG):
+        """Send events at or above level to hook"""
+        with self._lock:
+            self.hook = hook
+            self.level = level
+
+    def disable(self):
+        with self._lock:
+            self.level = OFF
+            self.hook = None
+
+    def emit(self, event: str, level: int = DEBUG, **fields):
+        hook = self.hook
+        if hook is not None and self.level <= level:
+            hook(event, level, fields)
+
+tracer = Tracer()
@@ -1,73 +1,137 @@
-from node import Node
+from node import Node, fold_tree, intern_node, make_node
+from tracing import DEBUG, INFO, tracer
 from collections import Counter
 from typing import List, Optional
+import hashlib
+import json
+
+# Version of the dictionary form written by ast_to_dict. Version 1, which has no version field,
+# wrote every field on every node and binary 'left'/'right' children.
+AST_SCHEMA_VERSION = 2
 
 def ast_to_dict(ast: Node) -> Optional[dict]:
-    """Convert an Abstract Syntax Tree (AST) node to a JSON-like dictionary"""
+    """
+    Convert an Abstract Syntax Tree (AST) node to a JSON-like dictionary in the compact schema:
+    operands carry attribute, operator and constant, operators carry value and children, and
+    the root carries the schema version.
+    """
     if ast is None:
         return None
-    return {
-        'type': ast.type,
-        'value': ast.value,
-        'attribute': ast.attribute,
-        'operator': ast.operator,
-        'constant': ast.constant,
-        'left': ast_to_dict(ast.left),
-        'right': ast_to_dict(ast.right)
-    }
+    root = {'version': AST_SCHEMA_VERSION, **_node_to_dict(ast)}
+    # Dictionaries are created parent first and their children lists filled in with an explicit stack
+    stack = [(ast, root)]
+    while stack:
+        node, node_dict = stack.pop()
+        if node.children is None:
+            continue
+        children = node_dict['children'] = []
+        for child in node.children:
+            if child is None:
+                children.append(None)
+                continue
+            child_dict = _node_to_dict(child)
+            children.append(child_dict)
+            stack.append((child, child_dict))
+    return root
+
+def _node_to_dict(node: Node) -> dict:
+    node_dict = {'type': node.type}
+    for field in ('value', 'attribute', 'operator', 'constant'):
+        value = getattr(node, field)
+        if value is not None:
+            node_dict[field] = value
+    return node_dict
 
 def dict_to_ast(ast_dict: dict) -> Node:
-    """Convert a JSON-like dictionary to an Abstract Syntax Tree (AST) node"""
+    """
+    Convert a JSON-like dictionary to an Abstract Syntax Tree (AST) node.
+    Accepts the compact schema as well as the older form with every field on every node and
+    binary 'left'/'right' children.
+    """
+    if ast_dict is None:
+        return None
+    version = ast_dict.get('version', 1)
+    if version > AST_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported AST schema version {version}")
+    return fold_tree(ast_dict, _dict_children, _dict_to_node)
+
+def _dict_children(ast_dict: dict):
     if ast_dict is None:
         return None
-    node = Node(
-        type=ast_dict['type'],
+    children = ast_dict.get('children')
+    if children is None:
+        children = [child for child in (ast_dict.get('left'), ast_dict.get('right')) if child is not None] or None
+    return children
+
+def _dict_to_node(ast_dict: dict, children: Optional[list]) -> Node:
+    if ast_dict is None:
+        return None
+    return make_node(
+        ast_dict['type'],
         value=ast_dict.get('value'),
         attribute=ast_dict.get('attribute'),
         operator=ast_dict.get('operator'),
-        constant=ast_dict.get('constant')
+        constant=ast_dict.get('constant'),
+        children=children
     )
-    node.left = dict_to_ast(ast_dict.get('left'))
-    node.right = dict_to_ast(ast_dict.get('right'))
-    return node
 
 def simplify_ast(node: Node) -> Node:
     """Apply simplification rules to an Abstract Syntax Tree (AST) node"""
     if node is None:
         return None
+    # Children are simplified before their parent
+    return fold_tree(node, _operator_children, _simplify_node)
 
-    # Recursively simplify left and right subtrees
-    node.left = simplify_ast(node.left)
-    node.right = simplify_ast(node.right)
-
-    # Apply simplification rules
-    if node.type == 'operator':
-        # Idempotent Law: A AND A = A
-        if node.left == node.right:
-            print(f"Applying Idempotent Law on node: {node}")
-            return node.left
-
-        # Absorption Law: A AND (A OR B) = A
-        if node.value == 'AND':
-            # Check for A AND (A OR B)
-            if node.right and node.right.type == 'operator' and node.right.value == 'AND':
-                right_left = node.right.left
-                right_right = node.right.right
-                if right_left and right_left.type == 'operator' and right_left.value == 'OR':
-                    if node.left == right_left.left or node.left == right_left.right:
-                        print(f"Applying Absorption Law on node: {node}")
-                        new_node = Node(
-                            type='operator',
-                            value='AND',
-                            left=node.left,
-                            right=right_right
-                        )
-                        return simplify_ast(new_node)
+def _operator_children(node: Node):
+    return node.children if node is not None and node.type == 'operator' else None
 
-    return node
+def _simplify_node(node: Node, simplified_children: Optional[list]) -> Node:
+    if node is None or node.type != 'operator':
+        return node
+
+    # Flatten nested chains of the same operator
+    children = []
+    for child in simplified_children:
+        if child.type == 'operator' and child.value == node.value:
+            children.extend(child.children)
+        else:
+            children.append(child)
+
+    # Idempotent Law: A AND A = A
+    unique_children = []
+    seen = set()
+    for child in children:
+        if child in seen:
+            if tracer.level <= DEBUG:
+                tracer.emit('simplify.idempotent', DEBUG, node=node, duplicate=child)
+            continue
+        seen.add(child)
+        unique_children.append(child)
+    children = unique_children
+
+    # Absorption Law: A AND (A OR B) = A
+    if node.value == 'AND':
+        absorbed = []
+        for child in children:
+            if child.type == 'operator' and child.value == 'OR' and any(
+                    grandchild in seen for grandchild in child.children):
+                if tracer.level <= DEBUG:
+                    tracer.emit('simplify.absorption', DEBUG, node=node, absorbed=child)
+                continue
+            absorbed.append(child)
+        children = absorbed
+
+    if len(children) == 1:
+        return children[0]
+    return make_node('operator', node.value, children=children)
 
 def ast_to_rule_string(node: Node) -> str:
     """Convert an Abstract Syntax Tree (AST) node to a string"""
+    if node is None:
+        return ''
+    return fold_tree(node, _operator_children, _node_to_rule_string)
+
+def _node_to_rule_string(node: Node, child_strings: Optional[list]) -> str:
     if node is None:
         return ''
     if node.type == 'operand':
@@ -75,13 +139,91 @@ def ast_to_rule_string(node: Node) -> str:
         constant = f"'{node.constant}'" if isinstance(node.constant, str) and not node.constant.isdigit() else node.constant
         return f"{node.attribute} {node.operator} {constant}"
     elif node.type == 'operator':
-        left_str = ast_to_rule_string(node.left)
-        right_str = ast_to_rule_string(node.right)
         # Add parentheses to preserve logical structure
-        return f"({left_str} {node.value} {right_str})"
+        return '(' + f' {node.value} '.join(child_strings) + ')'
     else:
         return ''
 
+def ast_metadata(ast: Node) -> dict:
+    """
+    Facts about a rule that are stored next to it so that queries do not have to load the AST:
+    the attributes it references, its number of conditions, its depth and its structural hash.
+    """
+    attributes = set()
+    operand_count = 0
+    depth = 0
+    stack = [(ast, 1)]
+    while stack:
+        node, node_depth = stack.pop()
+        if node is None:
+            continue
+        depth = max(depth, node_depth)
+        if node.type == 'operand':
+            attributes.add(node.attribute)
+            operand_count += 1
+        elif node.children:
+            stack.extend((child, node_depth + 1) for child in node.children)
+    return {
+        'attributes': sorted(attributes),
+        'operand_count': operand_count,
+        'depth': depth,
+        'structural_hash': structural_hash(ast)
+    }
+
+def structural_hash(ast: Node) -> str:
+    """SHA-256 of the AST's dictionary form, stable across processes unlike hash(node)"""
+    encoded = json.dumps(ast_to_dict(ast), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def canonical_ast(ast: Node) -> Node:
+    """
+    Canonical form of an AST, the same for rules that differ only in the order of AND/OR
+    children, in nesting or repeating children under the same operator, or in how a constant
+    is written. Equivalent rules share a canonical_hash.
+    """
+    if ast is None:
+        return None
+    node, _, _ = fold_tree(ast, _operator_children, _canonical_node)
+    return node
+
+def canonical_hash(ast: Node) -> str:
+    """SHA-256 of the canonical form of an AST"""
+    _, key, _ = fold_tree(ast, _operator_children, _canonical_node)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def normalize_constant(constant) -> str:
+    """
+    Write a constant the way it compares: numbers as text, and without the quotes that
+    evaluate_condition strips from constants that are not numbers
+    """
+    constant = str(constant)
+    stripped = constant.strip("'\"")
+    if stripped != constant:
+        try:
+            float(stripped)
+        except ValueError:
+            return stripped
+    return constant
+
+def _canonical_node(node: Node, canonical_children: Optional[list]):
+    # Builds (canonical node, sort key, its sorted children as such triples); the root's key is what canonical_hash digests
+    if node.type == 'operand':
+        constant = normalize_constant(node.constant)
+        key = json.dumps([node.attribute, node.operator, constant])
+        return make_node('operand', attribute=node.attribute, operator=node.operator, constant=constant), key, None
+    children = {}
+    for child, key, grandchildren in canonical_children:
+        if child.type == 'operator' and child.value == node.value:
+            # A child with the same operator is merged into its parent
+            children.update((grandchild[0], grandchild) for grandchild in grandchildren)
+        else:
+            children[child] = (child, key, grandchildren)
+    if len(children) == 1:
+        return next(iter(children.values()))
+    ordered = sorted(children.values(), key=lambda item: item[1])
+    key = node.value + '(' + ','.join(key for _, key, _ in ordered) + ')'
+    return make_node('operator', node.value, children=[child for child, _, _ in ordered]), key, ordered
+
 def combine_asts(asts: List[Node]) -> Node:
     """Combine multiple Abstract Syntax Trees (ASTs) into a single AST"""
     if not asts:
@@ -89,17 +231,14 @@ def combine_asts(asts: List[Node]) -> Node:
 
     # Step 1: Collect all operators to determine the most frequent one
     all_operators = []
-
-    def collect_operators(node):
-        if node is None:
-            return
-        if node.type == 'operator':
-            all_operators.append(node.value)
-        collect_operators(node.left)
-        collect_operators(node.right)
-
-    for ast in asts:
-        collect_operators(ast)
+    # Visit nodes in the same order as a left-to-right recursive walk, so ties keep their order
+    stack = list(reversed(asts))
+    while stack:
+        node = stack.pop()
+        if node is not None and node.type == 'operator':
+            # An n-ary node stands for len(children) - 1 binary operators
+            all_operators.extend([node.value] * (len(node.children) - 1))
+            stack.extend(reversed(node.children))
 
     # Determine the most frequent operator
     operator_counts = Counter(all_operators)
@@ -108,55 +247,47 @@ def combine_asts(asts: List[Node]) -> Node:
     else:
         primary_operator = 'OR'  # Default operator if none found
 
-    # Step 2: Identify and merge common conditions
-    condition_map = {}
-
-    def flatten_ast(node):
-        if node is None:
-            return
-        if node.type == 'operand':
-            key = (node.attribute, node.operator, node.constant)
-            condition_map.setdefault(key, []).append(node)
-        flatten_ast(node.left)
-        flatten_ast(node.right)
-
-    for ast in asts:
-        flatten_ast(ast)
+    # Step 2: Share identical conditions and subtrees, across these rules and every other loaded rule
+    reconstructed_asts = [intern_node(ast) for ast in asts]
 
-    # Step 3: Create unique operand nodes to avoid redundancy
-    unique_operands = {}
-    for key, nodes in condition_map.items():
-        first_node = nodes[0]
-        unique_operands[key] = first_node  # Use the existing node
+    # Step 3: Combine all ASTs under one node of the primary operator, rather than a chain as deep
+    # as the number of rules, with rules that share conditions next to each other
+    combined_ast = make_node(
+        'operator',
+        primary_operator,
+        children=group_shared_operands(reconstructed_asts)
+    )
 
-    # Step 4: Reconstruct ASTs with shared operand nodes
-    def replace_operands_with_unique(node):
-        if node is None:
-            return None
-        if node.type == 'operand':
-            key = (node.attribute, node.operator, node.constant)
-            return unique_operands.get(key, node)
-        else:
-            return Node(
-                type=node.type,
-                value=node.value,
-                left=replace_operands_with_unique(node.left),
-                right=replace_operands_with_unique(node.right)
-            )
-
-    reconstructed_asts = [replace_operands_with_unique(ast) for ast in asts]
-
-    # Step 5: Combine all ASTs using the primary operator
-    combined_ast = reconstructed_asts[0]
-    for ast in reconstructed_asts[1:]:
-        combined_ast = Node(
-            type='operator',
-            value=primary_operator,
-            left=combined_ast,
-            right=ast
-        )
-
-    # Step 6: Simplify the combined AST
+    # Step 4: Simplify the combined AST
     combined_ast = simplify_ast(combined_ast)
+    if tracer.level <= INFO:
+        tracer.emit('combine', INFO, rules=len(asts), operator=primary_operator, result=combined_ast)
 
     return combined_ast
+
+def group_shared_operands(asts: List[Node]) -> List[Node]:
+    """
+    Order ASTs so that each one follows the first earlier AST it shares a condition with.
+    ASTs sharing nothing keep their original order.
+    """
+    group_of = {}  # operand node -> index of the group that first used it
+    groups = []
+    for ast in asts:
+        operands = []
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if node.type == 'operand':
+                operands.append(node)
+            elif node.children:
+                stack.extend(node.children)
+        group = min((group_of[operand] for operand in operands if operand in group_of), default=None)
+        if group is None:
+            group = len(groups)
+            groups.append([])
+        groups[group].append(ast)
+        for operand in operands:
+            group_of.setdefault(operand, group)
+    return [ast for group in groups for ast in group]
@@ -0,0 +1,114 @@
+import numpy as np
+from evaluator import evaluate_ast, operators
+from node import Node, fold_tree
+
+def evaluate_ast_columns(ast: Node, columns) -> np.ndarray:
+    """
+    Evaluates an Abstract Syntax Tree of a rule against columnar input data.
+
+    columns maps each attribute to an array-like of values (a dict of NumPy arrays or a
+    pandas DataFrame). Returns a boolean mask with one entry per row, equal to evaluate_ast on
+    each row. Rows are compared with the same float-then-string coercion as evaluate_condition,
+    and AND/OR short-circuit row by row: a condition that cannot be evaluated on a row (a
+    missing attribute, a None value, an integer too large for a float) only matters where
+    evaluate_ast would reach it. If it does on some row, the error evaluate_ast raises on the
+    first such row is raised.
+    """
+    arrays = {attribute: np.asarray(values) for attribute, values in columns.items()}
+    row_count = len(next(iter(arrays.values()))) if arrays else 0
+    values, failed = fold_tree(
+        ast,
+        lambda node: node.children if node.type == 'operator' else None,
+        lambda node, children: _evaluate_node(node, children, arrays, row_count)
+    )
+    if failed.any():
+        row = int(np.argmax(failed))
+        # Raises the error of the first row that fails
+        evaluate_ast(ast, {attribute: array[row:row + 1].tolist()[0] for attribute, array in arrays.items()})
+    return values
+
+def _evaluate_node(node: Node, children, arrays: dict, row_count: int):
+    """Return the (values, failed) masks of a node from those of its children"""
+    if node.type == 'operand':
+        return evaluate_condition_column(node, arrays, row_count)
+    elif node.type != 'operator':
+        raise ValueError(f'Unknown node type {node.type}')
+    if node.value not in ('AND', 'OR'):
+        raise ValueError(f'Unknown operator {node.value}')
+    is_and = node.value == 'AND'
+    values = np.full(row_count, is_and)
+    failed = np.zeros(row_count, dtype=bool)
+    # Rows whose result is not decided by the children seen so far
+    pending = np.ones(row_count, dtype=bool)
+    for child_values, child_failed in children:
+        failed |= pending & child_failed
+        pending &= ~child_failed
+        # False under AND or true under OR decides the row
+        decided = pending & (child_values != is_and)
+        values[decided] = not is_and
+        pending &= ~decided
+    values[failed] = False
+    return values, failed
+
+def evaluate_condition_column(node: Node, arrays: dict, row_count: int):
+    """
+    Evaluates a condition of a rule against a whole column in one comparison where the column's
+    type allows it. Returns the mask of the rows it holds on and the mask of the rows on which
+    evaluate_condition raises.
+    """
+    attribute = node.attribute
+    op_func = operators.get(node.operator)
+    if attribute not in arrays or not op_func:
+        return np.zeros(row_count, dtype=bool), np.ones(row_count, dtype=bool)
+    column = arrays[attribute]
+    no_failures = np.zeros(row_count, dtype=bool)
+
+    string_constant = str(node.constant).strip("'\"")
+    try:
+        numeric_constant = float(node.constant)
+    except ValueError:
+        numeric_constant = None
+
+    if numeric_constant is not None:
+        if column.dtype.kind in 'biuf':
+            return op_func(column.astype(float, copy=False), numeric_constant), no_failures
+        if column.dtype.kind == 'O' and all(type(value) in (int, float) for value in column.tolist()):
+            try:
+                return op_func(np.array(column.tolist(), dtype=float), numeric_constant), no_failures
+            except OverflowError:
+                pass
+    elif node.operator in ('=', '!=') and not _is_numeric(string_constant):
+        # A value that parses as a number can never equal a non-numeric constant, so
+        # (in)equality against the raw column gives the same answer as the row path
+        if column.dtype.kind in 'biuf':
+            return np.full(row_count, node.operator == '!='), no_failures
+        if column.dtype.kind == 'U' or (column.dtype.kind == 'O' and
+                                        all(type(value) is str for value in column.tolist())):
+            return np.asarray(op_func(column.astype(str), string_constant), dtype=bool), no_failures
+
+    # Strings against numbers, ordering against strings, or values such as None that
+    # evaluate_condition rejects: compare row at a time, recording the rows that raise
+    values = np.zeros(row_count, dtype=bool)
+    failed = np.zeros(row_count, dtype=bool)
+    for row, value in enumerate(column.tolist()):
+        try:
+            values[row] = _compare(op_func, value, numeric_constant, string_constant)
+        except Exception:
+            failed[row] = True
+    return values, failed
+
+def _is_numeric(value) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def _compare(op_func, value, numeric_constant, string_constant) -> bool:
+    try:
+        value = float(value)
+        if numeric_constant is not None:
+            return op_func(value, numeric_constant)
+    except ValueError:
+        pass
+    return op_func(str(value), string_constant)
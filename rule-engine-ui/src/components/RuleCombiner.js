@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import axios from "axios";
 import RuleTree from "./RuleTree";
+import { fetchAllRules } from "../rulesApi";
 
 export default function RuleCombiner() {
   const [rules, setRules] = useState([]);
@@ -15,8 +16,7 @@ export default function RuleCombiner() {
 
   const fetchRules = async () => {
     try {
-      const response = await axios.get("http://localhost:5001/rules");
-      setRules(response.data.rules);
+      setRules(await fetchAllRules(["id", "rule_string"]));
     } catch (error) {
       console.error("Error fetching rules:", error);
       setError("Error fetching rules. Please try again later.");
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from "react";
 import axios from "axios";
+import { fetchAllRules } from "../rulesApi";
 
 export default function RuleEvaluator() {
   const [rules, setRules] = useState([]);
@@ -20,8 +21,7 @@ export default function RuleEvaluator() {
         (rule) => rule.id === parseInt(selectedRuleId)
       );
       if (selectedRule) {
-        const attrs = extractAttributesFromAst(selectedRule.ast);
-        setAttributes(attrs);
+        setAttributes(selectedRule.attributes);
         setData({});
       }
     } else {
@@ -32,30 +32,13 @@ export default function RuleEvaluator() {
 
   const fetchRules = async () => {
     try {
-      const response = await axios.get("http://localhost:5001/rules");
-      setRules(response.data.rules);
+      setRules(await fetchAllRules(["id", "rule_string", "attributes", "is_combined"]));
     } catch (error) {
       console.error("Error fetching rules:", error);
       setError(`Error: ${error.response?.data?.error || error.message}`);
     }
   };
 
-  const extractAttributesFromAst = (ast) => {
-    const attributesSet = new Set();
-
-    const traverse = (node) => {
-      if (!node) return;
-      if (node.type === "operand" && node.attribute) {
-        attributesSet.add(node.attribute);
-      }
-      traverse(node.left);
-      traverse(node.right);
-    };
-
-    traverse(ast);
-    return Array.from(attributesSet);
-  };
-
   const evaluateRule = async () => {
     const missingAttributes = attributes.filter(
       (attr) => data[attr] === undefined || data[attr] === ""
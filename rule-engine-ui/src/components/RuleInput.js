@@ -81,7 +81,11 @@ export default function RuleInput() {
       const response = await axios.post("http://localhost:5001/create_rule", {
         rule_string: ruleString,
       });
-      setSuccessMessage(`Rule saved with ID: ${response.data.rule_id}`);
+      setSuccessMessage(
+        response.status === 201
+          ? `Rule saved with ID: ${response.data.rule_id}`
+          : `An equivalent rule already exists with ID: ${response.data.rule_id}`
+      );
       setRuleString(""); // Clear the editor after saving
     } catch (error) {
       console.error("Error saving rule:", error);
@@ -1,11 +1,15 @@
 
 import React, { useEffect, useState } from 'react'
-import axios from 'axios'
 import { Loader2 } from 'lucide-react'
 import RuleTree from './RuleTree'
+import { fetchRulesPage } from '../rulesApi'
+
+const PAGE_SIZE = 50
 
 export default function RuleList() {
   const [rules, setRules] = useState([])
+  const [nextAfterId, setNextAfterId] = useState(null)
+  const [isLoadingMore, setIsLoadingMore] = useState(false)
   const [isLoading, setIsLoading] = useState(true)
   const [error, setError] = useState(null)
 
@@ -17,8 +21,9 @@ export default function RuleList() {
     try {
       setIsLoading(true)
       setError(null)
-      const response = await axios.get('http://localhost:5001/rules')
-      setRules(response.data.rules)
+      const page = await fetchRulesPage({ limit: PAGE_SIZE })
+      setRules(page.rules)
+      setNextAfterId(page.nextAfterId)
     } catch (error) {
       console.error('Error fetching rules:', error)
       setError(error instanceof Error ? error.message : 'An unknown error occurred')
@@ -27,6 +32,20 @@ export default function RuleList() {
     }
   }
 
+  const fetchMoreRules = async () => {
+    try {
+      setIsLoadingMore(true)
+      const page = await fetchRulesPage({ afterId: nextAfterId, limit: PAGE_SIZE })
+      setRules((prev) => [...prev, ...page.rules])
+      setNextAfterId(page.nextAfterId)
+    } catch (error) {
+      console.error('Error fetching rules:', error)
+      setError(error instanceof Error ? error.message : 'An unknown error occurred')
+    } finally {
+      setIsLoadingMore(false)
+    }
+  }
+
   if (isLoading) {
     return (
       <div className="flex items-center justify-center min-h-screen bg-gray-100">
@@ -71,6 +90,15 @@ export default function RuleList() {
                 </div>
               </div>
             ))}
+            {nextAfterId !== null && (
+              <button
+                onClick={fetchMoreRules}
+                disabled={isLoadingMore}
+                className="w-full px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600 transition-colors disabled:opacity-50"
+              >
+                {isLoadingMore ? 'Loading...' : 'Load More'}
+              </button>
+            )}
           </div>
         )}
       </div>
@@ -16,11 +16,12 @@ function RuleTree({ ast }) {
     } else {
       nodeName = "Unknown node type";
     }
+    // In the compact AST schema only operator nodes carry an n-ary `children` list;
+    // ASTs in the older form use `left`/`right`
+    const children = node.children || [node.left, node.right];
     return {
       name: nodeName,
-      children: [node.left, node.right]
-        .filter(Boolean)
-        .map(formatAstToTreeData),
+      children: children.filter(Boolean).map(formatAstToTreeData),
     };
   };
 
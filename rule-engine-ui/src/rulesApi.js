@@ -0,0 +1,26 @@
+import axios from "axios";
+
+const RULES_URL = "http://localhost:5001/rules";
+const PAGE_SIZE = 1000;
+
+// Fetch one page of rules; pass the previous page's nextAfterId as afterId to get the next one
+export async function fetchRulesPage({ afterId = 0, limit = PAGE_SIZE, fields } = {}) {
+  const params = { after_id: afterId, limit };
+  if (fields) {
+    params.fields = fields.join(",");
+  }
+  const response = await axios.get(RULES_URL, { params });
+  return { rules: response.data.rules, nextAfterId: response.data.next_after_id };
+}
+
+// Fetch every rule, following the pages, with only the requested fields
+export async function fetchAllRules(fields) {
+  const rules = [];
+  let afterId = 0;
+  while (afterId !== null) {
+    const page = await fetchRulesPage({ afterId, fields });
+    rules.push(...page.rules);
+    afterId = page.nextAfterId;
+  }
+  return rules;
+}